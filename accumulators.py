@@ -0,0 +1,269 @@
+class CastCount:
+    __slots__ = ('boss', 'trash', 'first_event')
+
+    def __init__(self, first_event):
+        self.boss = 0
+        self.trash = 0
+        self.first_event = first_event
+
+    def merge(self, other):
+        self.boss += other.boss
+        self.trash += other.trash
+        self.first_event = min(self.first_event, other.first_event)
+
+    def to_json(self):
+        return {
+            'boss': self.boss,
+            'trash': self.trash,
+            'first_event': self.first_event,
+        }
+
+
+class HealingCount:
+    __slots__ = ('count', 'amount', 'first_event')
+
+    def __init__(self, first_event):
+        self.count = 0
+        self.amount = 0
+        self.first_event = first_event
+
+    def merge(self, other):
+        self.count += other.count
+        self.amount += other.amount
+        self.first_event = min(self.first_event, other.first_event)
+
+    def to_json(self):
+        return {
+            'count': self.count,
+            'amount': self.amount,
+            'first_event': self.first_event,
+        }
+
+
+class DamageTaken:
+    __slots__ = ('count', 'amount')
+
+    def __init__(self):
+        self.count = 0
+        self.amount = 0
+
+    def merge(self, other):
+        self.count += other.count
+        self.amount += other.amount
+
+    def to_json(self):
+        return {
+            'count': self.count,
+            'amount': self.amount,
+        }
+
+
+class BuffUptime:
+    __slots__ = ('percentage', 'prebuff')
+
+    def __init__(self):
+        self.percentage = 0
+        self.prebuff = []
+
+    def merge(self, other):
+        self.percentage += other.percentage
+        self.prebuff = sorted(set(self.prebuff).union(other.prebuff))
+
+    def to_json(self):
+        return {
+            'percentage': self.percentage,
+            'prebuff': self.prebuff,
+        }
+
+
+class FightAccumulator:
+    __slots__ = ('fight', 'casts', 'healing', 'damage_taken', 'buffs', 'deaths', 'interrupts', 'resistances', 'gems',
+                 'enchants', 'imbues', 'roles', 'specs')
+
+    def __init__(self, fight):
+        self.fight = fight
+        self.casts = {}
+        self.healing = {}
+        self.damage_taken = {}
+        self.buffs = {}
+        self.deaths = 0
+        self.interrupts = {}
+        self.resistances = {}
+        self.gems = {}
+        self.enchants = []
+        self.imbues = {}
+        self.roles = []
+        self.specs = []
+
+    def add_cast(self, ability_id, timestamp, is_boss):
+        cast = self.casts.get(ability_id)
+        if cast is None:
+            cast = self.casts[ability_id] = CastCount(timestamp)
+
+        if is_boss:
+            cast.boss += 1
+        else:
+            cast.trash += 1
+
+    def add_healing(self, ability_id, timestamp, amount):
+        healing = self.healing.get(ability_id)
+        if healing is None:
+            healing = self.healing[ability_id] = HealingCount(timestamp)
+
+        healing.count += 1
+        healing.amount += amount
+
+    def add_damage_taken(self, ability_id, amount):
+        damage_taken = self.damage_taken.get(ability_id)
+        if damage_taken is None:
+            damage_taken = self.damage_taken[ability_id] = DamageTaken()
+
+        damage_taken.count += 1
+        damage_taken.amount += amount
+
+    def add_buff_uptime(self, buff_id, percentage):
+        buff = self.buffs.get(buff_id)
+        if buff is None:
+            buff = self.buffs[buff_id] = BuffUptime()
+
+        buff.percentage += percentage
+
+    def add_prebuff(self, buff_id, fight_id):
+        self.buffs[buff_id].prebuff.append(fight_id)
+
+    def add_death(self):
+        self.deaths += 1
+
+    def add_interrupt(self, ability_id):
+        self.interrupts[ability_id] = self.interrupts.get(ability_id, 0) + 1
+
+    def add_resistance(self, resistance, amount):
+        self.resistances[resistance] = self.resistances.get(resistance, 0) + amount
+
+    def add_gems(self, gem_id, count):
+        self.gems[gem_id] = self.gems.get(gem_id, 0) + count
+
+    def add_enchant(self, enchant):
+        if enchant not in self.enchants:
+            self.enchants.append(enchant)
+
+    def add_imbue(self, hand, imbue):
+        imbues = self.imbues.setdefault(hand, [])
+        if imbue not in imbues:
+            imbues.append(imbue)
+
+    def add_role(self, role):
+        if role not in self.roles:
+            self.roles.append(role)
+
+    def add_spec(self, spec):
+        if spec not in self.specs:
+            self.specs.append(spec)
+
+    def merge(self, other):
+        # gear, roles and specs are read per fight from the summary tables, so only event metrics are merged
+        for ability_id, cast in other.casts.items():
+            if ability_id not in self.casts:
+                self.casts[ability_id] = CastCount(cast.first_event)
+            self.casts[ability_id].merge(cast)
+
+        for ability_id, healing in other.healing.items():
+            if ability_id not in self.healing:
+                self.healing[ability_id] = HealingCount(healing.first_event)
+            self.healing[ability_id].merge(healing)
+
+        for ability_id, damage_taken in other.damage_taken.items():
+            if ability_id not in self.damage_taken:
+                self.damage_taken[ability_id] = DamageTaken()
+            self.damage_taken[ability_id].merge(damage_taken)
+
+        for buff_id, buff in other.buffs.items():
+            if buff_id not in self.buffs:
+                self.buffs[buff_id] = BuffUptime()
+            self.buffs[buff_id].merge(buff)
+
+        self.deaths += other.deaths
+        for ability_id, count in other.interrupts.items():
+            self.interrupts[ability_id] = self.interrupts.get(ability_id, 0) + count
+
+    def to_state(self):
+        # everything needed to continue aggregating later, see from_state
+        return {
+            'fight': self.fight,
+            'casts': {k: [v.boss, v.trash, v.first_event] for k, v in self.casts.items()},
+            'healing': {k: [v.count, v.amount, v.first_event] for k, v in self.healing.items()},
+            'damage_taken': {k: [v.count, v.amount] for k, v in self.damage_taken.items()},
+            'buffs': {k: [v.percentage, v.prebuff] for k, v in self.buffs.items()},
+            'deaths': self.deaths,
+            'interrupts': self.interrupts,
+            'resistances': self.resistances,
+            'gems': self.gems,
+            'enchants': self.enchants,
+            'imbues': self.imbues,
+            'roles': self.roles,
+            'specs': self.specs,
+        }
+
+    @staticmethod
+    def from_state(state):
+        # json turns the ability, buff and gem ids into strings, they have to be ints again to merge with new events
+        fight = FightAccumulator(state['fight'])
+        for ability_id, (boss, trash, first_event) in state['casts'].items():
+            cast = fight.casts[int(ability_id)] = CastCount(first_event)
+            cast.boss = boss
+            cast.trash = trash
+
+        for ability_id, (count, amount, first_event) in state['healing'].items():
+            healing = fight.healing[int(ability_id)] = HealingCount(first_event)
+            healing.count = count
+            healing.amount = amount
+
+        # states saved before damage taken was aggregated have none
+        for ability_id, (count, amount) in state.get('damage_taken', {}).items():
+            damage_taken = fight.damage_taken[int(ability_id)] = DamageTaken()
+            damage_taken.count = count
+            damage_taken.amount = amount
+
+        for buff_id, (percentage, prebuff) in state['buffs'].items():
+            buff = fight.buffs[int(buff_id)] = BuffUptime()
+            buff.percentage = percentage
+            buff.prebuff = prebuff
+
+        fight.deaths = state['deaths']
+        fight.interrupts = {int(k): v for k, v in state['interrupts'].items()}
+        fight.resistances = state['resistances']
+        fight.gems = {int(k): v for k, v in state['gems'].items()}
+        fight.enchants = state['enchants']
+        fight.imbues = state['imbues']
+        fight.roles = state['roles']
+        fight.specs = state['specs']
+        return fight
+
+    def to_json(self):
+        data = dict(self.fight)
+        if self.casts:
+            data['casts'] = {k: v.to_json() for k, v in self.casts.items()}
+        if self.healing:
+            data['healing'] = {k: v.to_json() for k, v in self.healing.items()}
+        if self.damage_taken:
+            data['damage_taken'] = {k: v.to_json() for k, v in self.damage_taken.items()}
+            data['damage_taken_total'] = sum(x.amount for x in self.damage_taken.values())
+        if self.buffs:
+            data['buffs'] = {k: v.to_json() for k, v in self.buffs.items()}
+        if self.deaths:
+            data['deaths'] = self.deaths
+        if self.interrupts:
+            data['interrupts'] = self.interrupts
+        if self.resistances:
+            data['resistances'] = self.resistances
+        if self.gems:
+            data['gems'] = self.gems
+        if self.enchants:
+            data['enchants'] = self.enchants
+        if self.imbues:
+            data['imbues'] = self.imbues
+        if self.roles:
+            data['roles'] = self.roles
+        if self.specs:
+            data['specs'] = self.specs
+        return data
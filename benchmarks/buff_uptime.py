@@ -0,0 +1,68 @@
+# Compares the buff uptime band/fight overlap against the previous per band list scan on synthetic long logs.
+# Run from the repository root: python -m benchmarks.buff_uptime
+import random
+import timeit
+
+import intervals
+from intervals import band_overlaps, FightWindows
+
+
+def create_log(fights, bands, seed=1):
+    rnd = random.Random(seed)
+    fight_list = []
+    time = 0
+    for fight_id in range(1, fights + 1):
+        length = rnd.randint(20000, 300000)
+        fight_list.append({'id': fight_id, 'start_time': time, 'end_time': time + length})
+        time += length + rnd.randint(1000, 60000)
+
+    band_list = []
+    band_time = 0
+    step = time // bands
+    for _ in range(bands):
+        start_time = band_time + rnd.randint(0, step // 2)
+        band_list.append({'startTime': start_time, 'endTime': start_time + rnd.randint(1, step // 2)})
+        band_time += step
+    return fight_list, band_list
+
+
+def list_scan(fights, bands):
+    results = []
+    for fight_band in fights:
+        overlapping = [x for x in bands if x['endTime'] > fight_band['start_time']
+                       and x['startTime'] < fight_band['end_time']]
+        if len(overlapping) == 0:
+            continue
+
+        buff_length = sum(min(x['endTime'], fight_band['end_time']) - max(x['startTime'], fight_band['start_time'])
+                          for x in overlapping)
+        results.append((fight_band, buff_length, fight_band['start_time'] in [x['startTime'] for x in bands]))
+    return results
+
+
+def sweep(fights, bands):
+    return list(band_overlaps(fights, sorted(bands, key=lambda x: x['startTime'])))
+
+
+def main():
+    for (fights, bands) in [(50, 500), (200, 2000), (500, 5000)]:
+        fight_list, band_list = create_log(fights, bands)
+        fight_windows = FightWindows(fight_list)
+        expected = list_scan(fight_list, band_list)
+        assert expected == sweep(fight_list, band_list)
+        assert all(x[1] <= x[0]['end_time'] - x[0]['start_time'] for x in expected)
+
+        number = 5
+        scan_time = timeit.timeit(lambda: list_scan(fight_list, band_list), number=number) / number
+        sweep_time = timeit.timeit(lambda: sweep(fight_list, band_list), number=number) / number
+        result = '%3d fights %4d bands  list scan %8.2fms  sweep %6.2fms' % (fights, bands, scan_time * 1000,
+                                                                             sweep_time * 1000)
+        if intervals.numpy is not None:
+            assert expected == list(fight_windows.band_overlaps(band_list))
+            numpy_time = timeit.timeit(lambda: list(fight_windows.band_overlaps(band_list)), number=number) / number
+            result += '  numpy %6.2fms' % (numpy_time * 1000)
+        print(result)
+
+
+if __name__ == '__main__':
+    main()
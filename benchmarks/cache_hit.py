@@ -0,0 +1,60 @@
+# Times building the cache hit response for large summary documents: decoding and encoding the stored json again
+# against returning the stored bytes as they are (plain or pre-compressed).
+# Run from the repository root: python -m benchmarks.cache_hit
+import asyncio
+import contextlib
+import io
+import json
+import os
+import timeit
+
+os.environ.setdefault('WCL_KEY', 'benchmark')
+os.environ.setdefault('S3_BUCKET', 'benchmark')
+
+import lambda_function
+import report_store
+import wcl_parser
+from benchmarks.fake_wcl import generate_report, create_app, start_server
+
+
+async def create_summary(characters):
+    runner, wcl_parser.WCLParser.BASE_DOMAIN = await start_server(create_app(generate_report(characters=characters)))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            async with wcl_parser.WCLParser('benchmark') as parser:
+                await parser.parse_report()
+        return parser.to_json(-1)
+    finally:
+        await runner.cleanup()
+
+
+def reserialize(file_content):
+    return {
+        "statusCode": 200,
+        "headers": {"content-type": lambda_function.CONTENT_TYPE_PATTERN % lambda_function.API_VERSION},
+        "body": json.dumps(json.loads(file_content))
+    }
+
+
+def main():
+    for characters in [10, 25, 40]:
+        documents = report_store.encode_fight(asyncio.run(create_summary(characters)))
+        document = documents[report_store.ENCODING_IDENTITY]
+
+        number = 50
+        results = ['%2d characters %5d KiB' % (characters, len(document) // 1024)]
+        timings = [('re-serialize', lambda: reserialize(document)),
+                   ('pass-through', lambda: lambda_function.cached_response(document, report_store.ENCODING_IDENTITY,
+                                                                            lambda_function.API_VERSION))]
+        for encoding in report_store.PRECOMPRESSED_ENCODINGS:
+            timings.append(('%s %d KiB' % (encoding, len(documents[encoding]) // 1024),
+                            lambda encoding=encoding: lambda_function.cached_response(documents[encoding], encoding,
+                                                                                      lambda_function.API_VERSION)))
+
+        for (name, timing) in timings:
+            results.append('%s %7.3fms' % (name, timeit.timeit(timing, number=number) / number * 1000))
+        print('  '.join(results))
+
+
+if __name__ == '__main__':
+    main()
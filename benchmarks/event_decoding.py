@@ -0,0 +1,42 @@
+# Compares decoding WCL event pages into full dicts with decoding them into the structs of event_schema, in time and
+# peak memory. Run from the repository root: python -m benchmarks.event_decoding
+import time
+import tracemalloc
+
+import json_codec
+import event_schema
+from benchmarks.fake_wcl import generate_report
+
+
+def measure(decode, pages):
+    # timed without tracemalloc, which slows down allocations
+    started = time.perf_counter()
+    for page in pages:
+        decode(page)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    # every page is kept, like the events of a fight before they are aggregated
+    decoded = [decode(page) for page in pages]
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, sum(len(x['events']) for x in decoded)
+
+
+def main():
+    report = generate_report(characters=40, fights=60, events_per_fight=80)
+    page_size = 10000
+    for event_type in ['casts', 'healing', 'damage-taken', 'buffs']:
+        events = report['events'][event_type]
+        pages = [json_codec.dumps({'events': events[x:x + page_size], 'nextPageTimestamp': 1})
+                 for x in range(0, len(events), page_size)]
+        results = ['%-12s %7d events' % (event_type, len(events))]
+        for (label, decode) in [('dicts', json_codec.loads), ('schema', event_schema.page_decoder(event_type))]:
+            elapsed, peak, count = measure(decode, pages)
+            assert count == len(events)
+            results.append('%s %7.1fms %7.1f MiB' % (label, elapsed * 1000, peak / 1024 / 1024))
+        print('  '.join(results))
+
+
+if __name__ == '__main__':
+    main()
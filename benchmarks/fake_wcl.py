@@ -0,0 +1,229 @@
+# A local stand-in for the warcraftlogs v1 api serving generated reports.
+# Serve: python -m benchmarks.fake_wcl [characters] [port], then run with WCL_BASE_DOMAIN=http://127.0.0.1:<port>
+import asyncio
+import json
+import random
+import sys
+import time
+from glob import glob
+from aiohttp import web
+
+
+REPORT_START_TIMESTAMP = 1640000000000
+BUFF_IDS = [976, 17629, 22782, 1126, 21562]
+
+
+def _gear_items():
+    items = {}
+    for file_name in sorted(glob('./data/*/*/*.json')):
+        with open(file_name) as json_file:
+            for item in json.load(json_file):
+                if 'slot' in item:
+                    items.setdefault(item['slot'], []).append(item['id'])
+    return items
+
+
+def _create_gear(rnd, items):
+    gear = []
+    for slot in range(19):
+        gear_item = {
+            'id': rnd.choice(items[slot]) if slot in items else 0,
+            'slot': slot,
+            'itemLevel': rnd.choice([81, 90, 99, 120, 141]),
+        }
+        if rnd.random() < 0.6:
+            gear_item['permanentEnchant'] = rnd.choice([1441, 2664, 903, 1888, 2564])
+            gear_item['permanentEnchantName'] = 'Enchant'
+        if rnd.random() < 0.3:
+            gear_item['gems'] = [{'id': rnd.choice([22459, 22460, 24027])} for _ in range(rnd.randint(1, 2))]
+        if slot in [15, 16] and rnd.random() < 0.5:
+            gear_item['temporaryEnchant'] = rnd.choice([2628, 2629])
+        gear.append(gear_item)
+    return gear
+
+
+def _create_bands(rnd, fights):
+    bands = []
+    for fight in fights:
+        chance = rnd.random()
+        if chance < 0.3:
+            continue
+
+        start_time = fight['start_time'] if chance < 0.6 else rnd.randint(fight['start_time'], fight['end_time'] - 1)
+        end_time = min(start_time + rnd.randint(1000, 400000), fight['end_time'] + rnd.randint(0, 30000))
+        if len(bands) == 0 or start_time > bands[-1]['endTime']:
+            bands.append({'startTime': start_time, 'endTime': end_time})
+    return bands
+
+
+def _random_events(rnd, fight, count, create_event):
+    return [create_event(rnd.randint(fight['start_time'], fight['end_time'])) for _ in range(rnd.randint(0, count))]
+
+
+def generate_report(characters=40, fights=60, events_per_fight=40, seed=1):
+    rnd = random.Random(seed)
+    items = _gear_items()
+
+    fight_list = []
+    time = 1000
+    for fight_id in range(1, fights + 1):
+        length = rnd.randint(20000, 300000)
+        fight = {'id': fight_id, 'boss': 0, 'start_time': time, 'end_time': time + length, 'name': 'Trash'}
+        if fight_id % 4 == 0:
+            fight.update(boss=1000 + fight_id, name='Boss %d' % fight_id, kill=rnd.random() > 0.3,
+                         fightPercentage=rnd.randint(0, 10000), size=characters)
+        fight_list.append(fight)
+        time += length + rnd.randint(1000, 60000)
+
+    friendlies = []
+    pets = []
+    events = {'casts': [], 'healing': [], 'damage-taken': [], 'interrupts': [], 'buffs': []}
+    auras = {}
+    for player_id in range(1, characters + 1):
+        friendlies.append({
+            'id': player_id,
+            'name': 'Player%d' % player_id,
+            'type': rnd.choice(['Druid', 'Mage', 'Priest', 'Rogue', 'Warrior']),
+            'fights': [{'id': x['id'], 'instances': 1} for x in fight_list if rnd.random() > 0.1],
+        })
+        pets.append({'id': 1000 + player_id, 'name': 'Pet%d' % player_id, 'petOwner': player_id, 'type': 'Pet'})
+
+        for fight in fight_list:
+            events['casts'] += _random_events(rnd, fight, events_per_fight, lambda timestamp: {
+                'timestamp': timestamp, 'type': rnd.choice(['cast', 'cast', 'begincast']), 'sourceID': player_id,
+                'targetID': 5000, 'fight': fight['id'],
+                'ability': {'name': 'Spell', 'guid': rnd.randint(1, 30), 'type': 1, 'abilityIcon': 'spell.jpg'}})
+            events['healing'] += _random_events(rnd, fight, events_per_fight // 2, lambda timestamp: {
+                'timestamp': timestamp, 'type': 'heal', 'sourceID': player_id, 'targetID': rnd.randint(1, characters),
+                'fight': fight['id'], 'amount': rnd.randint(1, 5000),
+                'ability': {'name': 'Heal', 'guid': rnd.randint(100, 110), 'type': 2, 'abilityIcon': 'heal.jpg'}})
+            events['damage-taken'] += _random_events(rnd, fight, events_per_fight // 2, lambda timestamp: {
+                'timestamp': timestamp, 'type': 'damage', 'sourceID': 5000, 'targetID': player_id,
+                'fight': fight['id'], 'amount': rnd.randint(1, 9000),
+                'ability': {'name': 'Hit', 'guid': rnd.randint(200, 210), 'type': 1, 'abilityIcon': 'hit.jpg'}})
+            if rnd.random() < 0.2:
+                events['interrupts'].append({
+                    'timestamp': rnd.randint(fight['start_time'], fight['end_time']), 'type': 'interrupt',
+                    'sourceID': rnd.choice([player_id, 1000 + player_id]), 'fight': fight['id'],
+                    'ability': {'name': 'Kick', 'guid': 1766, 'type': 1, 'abilityIcon': 'kick.jpg'}})
+
+        auras[player_id] = []
+        for guid in BUFF_IDS:
+            bands = _create_bands(rnd, fight_list)
+            auras[player_id].append({'name': 'Buff', 'guid': guid, 'type': 2, 'bands': bands})
+            for band in bands:
+                for event_type, timestamp in [('applybuff', band['startTime']), ('removebuff', band['endTime'])]:
+                    events['buffs'].append({'timestamp': timestamp, 'type': event_type, 'sourceID': player_id,
+                                            'targetID': player_id, 'ability': {'name': 'Buff', 'guid': guid}})
+
+    for event_list in events.values():
+        event_list.sort(key=lambda x: x['timestamp'])
+
+    summaries = {}
+    for fight_id in [-1] + [x['id'] for x in fight_list if x['boss'] > 0]:
+        players = [{'id': x['id'], 'name': x['name'], 'specs': [rnd.choice(['Holy', 'Fire', 'Arms'])],
+                    'combatantInfo': {'gear': _create_gear(rnd, items)}} for x in friendlies]
+        summaries[fight_id] = {'playerDetails': {'tanks': players[:2], 'healers': players[2:8], 'dps': players[8:]}}
+
+    return {
+        'title': 'Benchmark report',
+        'start': REPORT_START_TIMESTAMP,
+        'end': REPORT_START_TIMESTAMP + time,
+        'fights': fight_list,
+        'friendlies': friendlies,
+        'friendlyPets': pets,
+        'events': events,
+        'auras': auras,
+        'deaths': sorted([{'id': rnd.randint(1, characters), 'fight': fight['id'],
+                           'timestamp': rnd.randint(fight['start_time'], fight['end_time'])}
+                          for fight in [rnd.choice(fight_list) for _ in range(50)]], key=lambda x: x['timestamp']),
+        'summaries': summaries,
+    }
+
+
+def create_app(report, page_size=10000, latency=0.0, rate_limit=None, error_rate=0.0, seed=1):
+    # rate_limit: requests per second (with a burst of as many) before answering 429 with a Retry-After,
+    # error_rate: share of requests failing with a 500
+    app = web.Application()
+    app['requests'] = {}
+    app['throttled'] = 0
+    app['errors'] = 0
+    rnd = random.Random(seed)
+    bucket = {'tokens': rate_limit, 'updated': time.monotonic()}
+
+    async def count_request(request, endpoint):
+        app['requests'][endpoint] = app['requests'].get(endpoint, 0) + 1
+        if latency > 0:
+            await asyncio.sleep(latency)
+        if rate_limit is not None:
+            now = time.monotonic()
+            bucket['tokens'] = min(rate_limit, bucket['tokens'] + (now - bucket['updated']) * rate_limit)
+            bucket['updated'] = now
+            if bucket['tokens'] < 1:
+                app['throttled'] += 1
+                raise web.HTTPTooManyRequests(headers={'Retry-After': '1'})
+            bucket['tokens'] -= 1
+        if rnd.random() < error_rate:
+            app['errors'] += 1
+            raise web.HTTPInternalServerError()
+        return int(request.query.get('start', 0)), int(request.query.get('end', report['end']))
+
+    async def fights(request):
+        await count_request(request, 'fights')
+        return web.json_response({key: report[key] for key in ['title', 'start', 'end', 'fights', 'friendlies',
+                                                                'friendlyPets']})
+
+    async def events(request):
+        event_type = request.match_info['event_type']
+        start_time, end_time = await count_request(request, 'events/' + event_type)
+        source_key = 'targetID' if event_type in ['damage-taken', 'buffs'] else 'sourceID'
+        source_id = int(request.query['sourceid']) if 'sourceid' in request.query else None
+        selected = [x for x in report['events'][event_type] if start_time <= x['timestamp'] < end_time
+                    and (source_id is None or x[source_key] == source_id)]
+
+        # pages never split events sharing a timestamp, a page ends after all those of its last event instead.
+        # So the next page starts after the previous one however many events share a timestamp
+        length = min(page_size, len(selected))
+        while 0 < length < len(selected) and selected[length]['timestamp'] == selected[length - 1]['timestamp']:
+            length += 1
+        body = {'events': selected[:length], 'count': len(selected)}
+        if length < len(selected):
+            body['nextPageTimestamp'] = selected[length]['timestamp']
+        return web.json_response(body)
+
+    async def tables(request):
+        table = request.match_info['table']
+        start_time, end_time = await count_request(request, 'tables/' + table)
+        if table == 'buffs':
+            return web.json_response({'auras': report['auras'].get(int(request.query['sourceid']), [])})
+        if table == 'deaths':
+            return web.json_response({'entries': [x for x in report['deaths']
+                                                  if start_time <= x['timestamp'] < end_time]})
+        if table == 'summary':
+            return web.json_response(report['summaries'][int(request.query.get('fight', -1))])
+        raise web.HTTPNotFound()
+
+    app.router.add_get('/v1/report/fights/{report_id}', fights)
+    app.router.add_get('/v1/report/events/{event_type}/{report_id}', events)
+    app.router.add_get('/v1/report/tables/{table}/{report_id}', tables)
+    return app
+
+
+async def start_server(app, port=8765):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner, 'http://127.0.0.1:%d' % port
+
+
+async def serve(characters, port):
+    runner, base_domain = await start_server(create_app(generate_report(characters=characters)), port)
+    print('Serving a report with %d characters on %s' % (characters, base_domain))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(serve(int(sys.argv[1]) if len(sys.argv) > 1 else 25, int(sys.argv[2]) if len(sys.argv) > 2 else 8765))
@@ -0,0 +1,37 @@
+# Compares per character and report wide event fetching against a local fake WCL server.
+# Run from the repository root: python -m benchmarks.fetch_modes
+import asyncio
+import contextlib
+import io
+import os
+import time
+
+os.environ.setdefault('WCL_KEY', 'benchmark')
+
+import wcl_parser
+from benchmarks.fake_wcl import generate_report, create_app, start_server
+
+
+async def run_mode(report, fetch_mode, latency):
+    app = create_app(report, latency=latency)
+    runner, wcl_parser.WCLParser.BASE_DOMAIN = await start_server(app)
+    try:
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            async with wcl_parser.WCLParser('benchmark', fetch_mode) as parser:
+                await parser.parse_report()
+        return time.perf_counter() - started, sum(app['requests'].values())
+    finally:
+        await runner.cleanup()
+
+
+async def main():
+    for characters in [10, 25, 40]:
+        report = generate_report(characters=characters)
+        for fetch_mode in [wcl_parser.FETCH_MODE_CHARACTER, wcl_parser.FETCH_MODE_REPORT]:
+            elapsed, requests = await run_mode(report, fetch_mode, latency=0.05)
+            print('%2d characters  %-9s  %4d requests  %6.2fs' % (characters, fetch_mode, requests, elapsed))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+# Times decoding WCL event pages and encoding/decoding fight documents with every available JSON codec.
+# Run from the repository root: python -m benchmarks.json_codecs
+import asyncio
+import contextlib
+import io
+import os
+import timeit
+
+os.environ.setdefault('WCL_KEY', 'benchmark')
+
+import json_codec
+import wcl_parser
+from benchmarks.fake_wcl import generate_report, create_app, start_server
+
+
+async def create_summary(report):
+    runner, wcl_parser.WCLParser.BASE_DOMAIN = await start_server(create_app(report))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            async with wcl_parser.WCLParser('benchmark') as parser:
+                await parser.parse_report()
+        return parser.to_json(-1)
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    report = generate_report(characters=40)
+    # an events page as WCL sends it (up to 10000 events), and the largest document that is stored
+    events = json_codec.CODECS['json'][1]({'events': report['events']['casts'][:10000], 'nextPageTimestamp': 1})
+    summary = asyncio.run(create_summary(report))
+    document = json_codec.CODECS['json'][1](summary)
+
+    number = 20
+    for name, (loads, dumps) in json_codec.CODECS.items():
+        assert loads(dumps(summary)) == loads(document)
+        results = ['%-8s' % name]
+        for (label, timing) in [('events page %d KiB decode' % (len(events) // 1024), lambda: loads(events)),
+                                ('summary %d KiB decode' % (len(document) // 1024), lambda: loads(document)),
+                                ('encode', lambda: dumps(summary))]:
+            results.append('%s %7.2fms' % (label, timeit.timeit(timing, number=number) / number * 1000))
+        print('  '.join(results))
+
+
+if __name__ == '__main__':
+    main()
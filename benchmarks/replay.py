@@ -0,0 +1,137 @@
+# Records the responses of warcraftlogs to a fixture file and serves them again from a local server, so a report can
+# be parsed offline and the same way every time.
+# Record (needs a WCL_KEY): python -m benchmarks.replay record <report id> <fixture file>
+# Serve:                    python -m benchmarks.replay serve <fixture file> [port]
+import asyncio
+import contextlib
+import gzip
+import io
+import json
+import os
+import sys
+import aiohttp
+from aiohttp import web
+
+os.environ.setdefault('WCL_KEY', 'benchmark')
+
+import wcl_parser
+from benchmarks.fake_wcl import start_server
+
+
+FIXTURE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+RECORDING_PORT = 8764
+
+
+def request_key(request):
+    # the api key is left out, fixtures recorded with one key replay for any other
+    query = sorted((key, value) for key, value in request.query.items() if key != 'api_key')
+    return request.path + '?' + '&'.join('%s=%s' % x for x in query)
+
+
+def load_fixture(file_name):
+    with gzip.open(file_name, 'rt', encoding='utf-8') as fixture_file:
+        return json.load(fixture_file)
+
+
+def save_fixture(fixture, file_name):
+    os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    with gzip.open(file_name, 'wt', encoding='utf-8') as fixture_file:
+        json.dump(fixture, fixture_file)
+
+
+def fixture_files():
+    if not os.path.isdir(FIXTURE_DIRECTORY):
+        return []
+
+    return sorted(os.path.join(FIXTURE_DIRECTORY, x) for x in os.listdir(FIXTURE_DIRECTORY) if x.endswith('.json.gz'))
+
+
+def create_recording_app(upstream, fixture):
+    # forwards every request to upstream and keeps the response in the fixture. Throttled and failed requests are
+    # passed on without being kept, the parser retries them
+    app = web.Application()
+
+    async def open_session(app):
+        app['session'] = aiohttp.ClientSession(upstream)
+
+    async def close_session(app):
+        await app['session'].close()
+
+    async def forward(request):
+        async with app['session'].get(request.rel_url) as response:
+            body = await response.read()
+            headers = {x: response.headers[x] for x in ['Retry-After'] if x in response.headers}
+            if response.status != 429 and response.status < 500:
+                fixture['responses'][request_key(request)] = [response.status, response.content_type,
+                                                              body.decode('utf-8')]
+            return web.Response(status=response.status, body=body, content_type=response.content_type,
+                                headers=headers)
+
+    app.on_startup.append(open_session)
+    app.on_cleanup.append(close_session)
+    app.router.add_get('/{path:.*}', forward)
+    return app
+
+
+def create_replay_app(fixture, latency=0.0):
+    # requests that were not recorded are answered with a 404 and listed in app['stats']['misses']
+    app = web.Application()
+    app['stats'] = {'requests': 0, 'misses': []}
+
+    async def replay(request):
+        app['stats']['requests'] += 1
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+        key = request_key(request)
+        if key not in fixture['responses']:
+            app['stats']['misses'].append(key)
+            raise web.HTTPNotFound(text='%s was not recorded' % key)
+
+        (status, content_type, body) = fixture['responses'][key]
+        return web.Response(status=status, text=body, content_type=content_type)
+
+    app.router.add_get('/{path:.*}', replay)
+    return app
+
+
+async def record(report_id, upstream=wcl_parser.WCLParser.BASE_DOMAIN, port=RECORDING_PORT):
+    # the report is parsed in both fetch modes with every metric, so the fixture replays whatever the configuration
+    fixture = {'report_id': report_id, 'responses': {}}
+    base_domain = wcl_parser.WCLParser.BASE_DOMAIN
+    runner, wcl_parser.WCLParser.BASE_DOMAIN = await start_server(create_recording_app(upstream, fixture), port)
+    try:
+        for fetch_mode in [wcl_parser.FETCH_MODE_CHARACTER, wcl_parser.FETCH_MODE_REPORT]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                async with wcl_parser.WCLParser(report_id, fetch_mode, metrics=list(wcl_parser.FETCH_PLAN)) as parser:
+                    await parser.parse_report()
+    finally:
+        wcl_parser.WCLParser.BASE_DOMAIN = base_domain
+        await runner.cleanup()
+
+    return fixture
+
+
+async def serve(fixture, port):
+    runner, base_domain = await start_server(create_replay_app(fixture), port)
+    print('Replaying %s (%d responses) on %s' % (fixture['report_id'], len(fixture['responses']), base_domain))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    if len(sys.argv) >= 4 and sys.argv[1] == 'record':
+        fixture = asyncio.run(record(sys.argv[2]))
+        save_fixture(fixture, sys.argv[3])
+        print('Recorded %d responses to %s' % (len(fixture['responses']), sys.argv[3]))
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'serve':
+        asyncio.run(serve(load_fixture(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 8765))
+    else:
+        print('usage: python -m benchmarks.replay record <report id> <fixture file>\n'
+              '       python -m benchmarks.replay serve <fixture file> [port]')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# Times parse_report, to_json and lambda_handler end to end on replayed reports, with S3 mocked by moto: a small, a
+# medium and a 40 player full clear report generated by fake_wcl, and every fixture recorded to benchmarks/fixtures
+# with benchmarks.replay.
+# Run from the repository root: python -m benchmarks.suite [repeat]
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import threading
+import time
+
+os.environ.setdefault('WCL_KEY', 'benchmark')
+os.environ.setdefault('S3_BUCKET', 'benchmark')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+import boto3
+from moto import mock_aws
+
+import lambda_function
+import report_store
+import wcl_parser
+import wcl_session
+from benchmarks.fake_wcl import generate_report, create_app, start_server
+from benchmarks.replay import create_replay_app, record, load_fixture, fixture_files
+
+
+GENERATED_REPORTS = [
+    ('small', {'characters': 10, 'fights': 20}),
+    ('medium', {'characters': 25, 'fights': 40}),
+    ('full clear', {'characters': 40, 'fights': 80, 'events_per_fight': 60}),
+]
+FAKE_WCL_PORT = 8765
+REPLAY_PORT = 8766
+
+
+async def record_generated(report_id, report):
+    runner, upstream = await start_server(create_app(report), FAKE_WCL_PORT)
+    try:
+        return await record(report_id, upstream)
+    finally:
+        await runner.cleanup()
+
+
+def start_replay_server(fixture):
+    # lambda_handler runs the parser on the loop of wcl_session, the server gets a loop of its own
+    loop = asyncio.new_event_loop()
+    app = create_replay_app(fixture)
+    runner, base_domain = loop.run_until_complete(start_server(app, REPLAY_PORT))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    return app, base_domain, stop
+
+
+async def parse(report_id):
+    async with lambda_function.create_parser(report_id) as parser:
+        return await parser.parse_report()
+
+
+def to_json(parser):
+    fight_ids = [x['id'] for x in parser.fights.values() if x['boss'] > 0] + [-1, 0]
+    return {fight: parser.to_json(fight) for fight in fight_ids}
+
+
+def call_handler(report_id):
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = lambda_function.lambda_handler({"pathParameters": {"id": report_id, "fight": "-1"}}, {})
+    assert response['statusCode'] == 200, response
+    return response
+
+
+def measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, timings
+
+
+def measure_lambda(report_id, repeat):
+    # cold: nothing cached in S3 or in the container, warm: the same request again
+    cold = []
+    warm = []
+    for _ in range(repeat):
+        with mock_aws():
+            boto3.client('s3', region_name='ap-southeast-2').create_bucket(
+                Bucket=lambda_function.S3_BUCKET, CreateBucketConfiguration={'LocationConstraint': 'ap-southeast-2'})
+            lambda_function._s3_client = None
+            lambda_function._report_lock = None
+            report_store.invalidate_report(report_id, lambda_function.API_VERSION)
+
+            cold.append(measure(lambda: call_handler(report_id), 1)[1][0])
+            warm.append(measure(lambda: call_handler(report_id), 1)[1][0])
+    return cold, warm
+
+
+def summarize(name, timings):
+    return '%s %8.1fms (min %8.1fms)' % (name, statistics.median(timings), min(timings))
+
+
+def run_fixture(name, fixture, repeat):
+    app, wcl_parser.WCLParser.BASE_DOMAIN, stop = start_replay_server(fixture)
+    try:
+        report_id = fixture['report_id']
+        with contextlib.redirect_stdout(io.StringIO()):
+            parser, parse_timings = measure(lambda: wcl_session.run(parse(report_id)), repeat)
+        requests = app['stats']['requests'] // repeat
+        documents, to_json_timings = measure(lambda: to_json(parser), repeat)
+        cold, warm = measure_lambda(report_id, repeat)
+        assert len(app['stats']['misses']) == 0, 'not recorded: %s' % app['stats']['misses'][:5]
+
+        print('%-12s %3d characters %3d fights %5d requests  %s  %s  %s  %s' % (
+            name, len(parser.characters), len(documents) - 2, requests, summarize('parse_report', parse_timings),
+            summarize('to_json', to_json_timings), summarize('lambda cold', cold), summarize('warm', warm)))
+    finally:
+        stop()
+        wcl_session.close()
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    for (name, parameters) in GENERATED_REPORTS:
+        report_id = 'Benchmark%07d' % parameters['characters']
+        fixture = asyncio.run(record_generated(report_id, generate_report(**parameters)))
+        run_fixture(name, fixture, repeat)
+
+    for file_name in fixture_files():
+        run_fixture(os.path.basename(file_name)[:-len('.json.gz')], load_fixture(file_name), repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# Parses a report against a local fake WCL server that throttles (429 with Retry-After) and fails requests, and
+# checks the result matches a parse without faults.
+# Run from the repository root: python -m benchmarks.throttling
+import asyncio
+import contextlib
+import io
+import json
+import os
+import time
+
+os.environ.setdefault('WCL_KEY', 'benchmark')
+
+import wcl_parser
+from benchmarks.fake_wcl import generate_report, create_app, start_server
+
+
+async def parse(report, fetch_mode, **faults):
+    app = create_app(report, page_size=500, latency=0.02, **faults)
+    runner, wcl_parser.WCLParser.BASE_DOMAIN = await start_server(app)
+    try:
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            async with wcl_parser.WCLParser('benchmark', fetch_mode) as parser:
+                await parser.parse_report()
+        elapsed = time.perf_counter() - started
+        summary = json.dumps(parser.to_json(-1), sort_keys=True)
+        return summary, elapsed, app, parser._scheduler.stats
+    finally:
+        await runner.cleanup()
+
+
+async def main():
+    report = generate_report(characters=25)
+    for fetch_mode in [wcl_parser.FETCH_MODE_CHARACTER, wcl_parser.FETCH_MODE_REPORT]:
+        expected, elapsed, app, stats = await parse(report, fetch_mode)
+        print('%-9s  %-30s  %4d requests  %6.2fs' % (fetch_mode, 'no faults', stats['requests'], elapsed))
+        for faults in [{'rate_limit': 15}, {'error_rate': 0.05}, {'rate_limit': 15, 'error_rate': 0.05}]:
+            summary, elapsed, app, stats = await parse(report, fetch_mode, **faults)
+            assert summary == expected
+            print('%-9s  %-30s  %4d requests  %6.2fs  %3d throttled  %3d errors  %3d retries' % (
+                fetch_mode, ' '.join('%s=%s' % x for x in faults.items()), stats['requests'], elapsed,
+                app['throttled'], app['errors'], stats['retries']))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+from typing import List, Optional
+import json_codec
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+# events pages decoded into structs holding only the fields the aggregators read, everything else in the payload is
+# skipped without being allocated. Without msgspec pages are decoded into plain dicts by json_codec
+if msgspec is not None:
+    class _Entry(msgspec.Struct):
+        # read like the dicts of a full decode: entry['fight'], 'targetID' in entry
+        def __getitem__(self, key):
+            return getattr(self, key)
+
+        def __contains__(self, key):
+            return getattr(self, key, None) is not None
+
+    class Ability(_Entry):
+        guid: int
+
+    class CastEvent(_Entry):
+        timestamp: int
+        type: str
+        ability: Ability
+        fight: Optional[int] = None
+        sourceID: Optional[int] = None
+
+    class HealingEvent(_Entry):
+        timestamp: int
+        ability: Ability
+        fight: Optional[int] = None
+        sourceID: Optional[int] = None
+        amount: int = 0
+
+    class DamageTakenEvent(_Entry):
+        timestamp: int
+        ability: Ability
+        fight: Optional[int] = None
+        targetID: Optional[int] = None
+        amount: int = 0
+
+    class BuffEvent(_Entry):
+        timestamp: int
+        type: str
+        ability: Ability
+        targetID: Optional[int] = None
+
+    class InterruptEvent(_Entry):
+        timestamp: int
+        ability: Ability
+        fight: Optional[int] = None
+        sourceID: Optional[int] = None
+
+    def _page_decoder(event_class):
+        class EventsPage(_Entry):
+            events: List[event_class]
+            nextPageTimestamp: Optional[int] = None
+
+        return msgspec.json.Decoder(EventsPage).decode
+
+    _DECODERS = {
+        'casts': _page_decoder(CastEvent),
+        'healing': _page_decoder(HealingEvent),
+        'damage-taken': _page_decoder(DamageTakenEvent),
+        'buffs': _page_decoder(BuffEvent),
+        'interrupts': _page_decoder(InterruptEvent),
+    }
+else:
+    _DECODERS = {}
+
+
+def page_decoder(event_type):
+    return _DECODERS.get(event_type, json_codec.loads)
@@ -3,3 +3,17 @@ class NotFoundException(Exception):
     def __init__(self, message):
         self.message = message
         super().__init__(self.message)
+
+
+class RequestException(Exception):
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class DeadlineException(Exception):
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,117 @@
+import contextlib
+import json
+import os
+import time
+
+
+# the per request, per character and per item prints. The metrics line of emit is always written
+VERBOSE_LOGGING = os.environ.get('VERBOSE_LOGGING', '1').lower() in ['1', 'true']
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'LogSummary')
+# upper bounds of the request latency histogram buckets in milliseconds, the last bucket is everything slower
+LATENCY_BUCKETS = [25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+# name -> milliseconds, summed when a stage runs more than once (decode and aggregate run for every response)
+_stages = {}
+# endpoint (fights, events/casts, tables/buffs, ...) -> request counts, bytes and latencies
+_endpoints = {}
+_properties = {}
+
+
+def reset():
+    # a warm container keeps the module, every invocation starts over
+    _stages.clear()
+    _endpoints.clear()
+    _properties.clear()
+
+
+def verbose(message):
+    if VERBOSE_LOGGING:
+        print(message)
+
+
+def set_property(name, value):
+    _properties[name] = value
+
+
+def add_time(name, milliseconds):
+    _stages[name] = _stages.get(name, 0.0) + milliseconds
+
+
+@contextlib.contextmanager
+def timer(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, (time.perf_counter() - started) * 1000)
+
+
+def endpoint(path):
+    # /v1/report/events/casts/<report id> -> events/casts
+    return '/'.join(path.split('?')[0].split('/')[3:-1])
+
+
+def _get_endpoint(path):
+    name = endpoint(path)
+    if name not in _endpoints:
+        _endpoints[name] = {
+            'requests': 0,
+            'throttled': 0,
+            'errors': 0,
+            'bytes': 0,
+            'latency_ms': 0.0,
+            'max_latency_ms': 0.0,
+            'histogram': [0] * (len(LATENCY_BUCKETS) + 1),
+        }
+    return _endpoints[name]
+
+
+def record_request(path, status, latency_ms):
+    stats = _get_endpoint(path)
+    stats['requests'] += 1
+    if status == 429:
+        stats['throttled'] += 1
+    elif status is None or status >= 500:
+        stats['errors'] += 1
+    stats['latency_ms'] += latency_ms
+    stats['max_latency_ms'] = max(stats['max_latency_ms'], latency_ms)
+    bucket = next((i for i, x in enumerate(LATENCY_BUCKETS) if latency_ms <= x), len(LATENCY_BUCKETS))
+    stats['histogram'][bucket] += 1
+
+
+def record_bytes(path, length):
+    _get_endpoint(path)['bytes'] += length
+
+
+def _totals():
+    totals = {name: sum(x[name] for x in _endpoints.values()) for name in ['requests', 'throttled', 'errors', 'bytes']}
+    for name, milliseconds in _stages.items():
+        totals[name + '_ms'] = round(milliseconds, 1)
+    return totals
+
+
+def emit(**properties):
+    # a single line in the CloudWatch embedded metric format: the totals and stage timers become metrics, the per
+    # endpoint breakdown is kept as properties of the log event
+    totals = _totals()
+    buckets = ['<=%d' % x for x in LATENCY_BUCKETS] + ['>%d' % LATENCY_BUCKETS[-1]]
+    line = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [[]],
+                'Metrics': [{'Name': x, 'Unit': 'Milliseconds' if x.endswith('_ms') else
+                             'Bytes' if x == 'bytes' else 'Count'} for x in totals.keys()],
+            }],
+        },
+        'endpoints': {name: dict(stats, latency_ms=round(stats['latency_ms'], 1),
+                                 max_latency_ms=round(stats['max_latency_ms'], 1),
+                                 histogram=dict(zip(buckets, stats['histogram'])))
+                      for name, stats in _endpoints.items()},
+    }
+    line.update(_properties)
+    line.update(properties)
+    line.update(totals)
+    print(json.dumps(line))
+    return line
@@ -0,0 +1,81 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def merge_bands(bands):
+    # sorted by start time, bands overlapping each other joined so the time they share counts once. Bands that only
+    # touch are kept apart, a band starting with a fight marks a prebuff
+    merged = []
+    for band in sorted(bands, key=lambda x: x['startTime']):
+        if len(merged) > 0 and band['startTime'] < merged[-1]['endTime']:
+            if band['endTime'] > merged[-1]['endTime']:
+                merged[-1] = {'startTime': merged[-1]['startTime'], 'endTime': band['endTime']}
+        else:
+            merged.append(band)
+    return merged
+
+
+def band_overlaps(fights, bands):
+    # fights and bands must be sorted by start time, and bands must not overlap each other (merge_bands). Bands ending
+    # before a fight can never overlap a later one, so a single pointer moves forward through the bands while
+    # sweeping the fights.
+    # yields (fight, buff_length, prebuff) for every fight overlapped by at least one band, with bands clipped to the
+    # fight window
+    band_starts = {x['startTime'] for x in bands}
+    first_band = 0
+    for fight in fights:
+        while first_band < len(bands) and bands[first_band]['endTime'] <= fight['start_time']:
+            first_band += 1
+
+        buff_length = 0
+        overlaps = False
+        band_index = first_band
+        while band_index < len(bands) and bands[band_index]['startTime'] < fight['end_time']:
+            band = bands[band_index]
+            if band['endTime'] > fight['start_time']:
+                overlaps = True
+                buff_length += min(band['endTime'], fight['end_time']) - max(band['startTime'], fight['start_time'])
+            band_index += 1
+
+        if overlaps:
+            yield fight, buff_length, fight['start_time'] in band_starts
+
+
+class FightWindows:
+    def __init__(self, fights):
+        self.fights = sorted(fights, key=lambda x: x['start_time'])
+        if numpy is not None:
+            self._starts = numpy.array([x['start_time'] for x in self.fights], dtype=numpy.int64)
+            self._ends = numpy.array([x['end_time'] for x in self.fights], dtype=numpy.int64)
+
+    def band_overlaps(self, bands):
+        if numpy is None:
+            return band_overlaps(self.fights, merge_bands(bands))
+
+        return self._numpy_band_overlaps(merge_bands(bands))
+
+    def _numpy_band_overlaps(self, bands):
+        if len(bands) == 0:
+            return
+
+        band_starts = numpy.sort(numpy.array([x['startTime'] for x in bands], dtype=numpy.int64))
+        band_ends = numpy.sort(numpy.array([x['endTime'] for x in bands], dtype=numpy.int64))
+        start_sums = numpy.concatenate(([0], numpy.cumsum(band_starts)))
+        end_sums = numpy.concatenate(([0], numpy.cumsum(band_ends)))
+
+        def covered(times):
+            # total length of all bands clipped to [-inf, time]
+            started = numpy.searchsorted(band_starts, times, 'left')
+            ended = numpy.searchsorted(band_ends, times, 'right')
+            return end_sums[ended] + times * (started - ended) - start_sums[started]
+
+        overlapping = (numpy.searchsorted(band_starts, self._ends, 'left')
+                       - numpy.searchsorted(band_ends, self._starts, 'right'))
+        buff_lengths = covered(self._ends) - covered(self._starts)
+        prebuff_index = numpy.minimum(numpy.searchsorted(band_starts, self._starts, 'left'), len(bands) - 1)
+        prebuffs = band_starts[prebuff_index] == self._starts
+
+        for index in numpy.flatnonzero(overlapping > 0).tolist():
+            yield self.fights[index], int(buff_lengths[index]), bool(prebuffs[index])
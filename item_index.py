@@ -0,0 +1,164 @@
+import json
+import mmap
+import os
+import struct
+from glob import glob
+
+
+ITEM_DATA_GLOB = './data/*/*/*.json'
+ITEM_INDEX_PATH = './data/items.idx'
+
+RESISTANCES = ['arcane', 'fire', 'frost', 'nature', 'shadow']
+
+# header: magic, format version, record count
+# record: id, slot, flags, sockets, arcane/fire/frost/nature/shadow resistance
+_MAGIC = b'WCLI'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHI')
+_RECORD = struct.Struct('<IbHB5h')
+_ID = struct.Struct('<I')
+
+_FLAG_RANDOM_ENCHANTMENT = 1 << 0
+_FLAG_NOT_ENCHANTABLE = 1 << 1
+_FLAG_HAS_SLOT = 1 << 2
+_FLAG_HAS_SOCKETS = 1 << 3
+_FLAG_HAS_RESISTANCE = [1 << (4 + x) for x in range(len(RESISTANCES))]
+
+# process-wide state, shared by every WCLParser in a (warm) lambda container
+_item_index = None
+_item_cache = {}
+_item_cache_stats = {
+    'index_loads': 0,
+    'hits': 0,
+    'misses': 0,
+}
+
+
+def _pack_item(item):
+    flags = 0
+    if item.get('randomEnchantment') is True:
+        flags |= _FLAG_RANDOM_ENCHANTMENT
+    if item.get('notEnchantable') is True:
+        flags |= _FLAG_NOT_ENCHANTABLE
+    if item.get('slot') is not None:
+        flags |= _FLAG_HAS_SLOT
+    if item.get('sockets') is not None:
+        flags |= _FLAG_HAS_SOCKETS
+
+    resistances = item['resistances'] if 'resistances' in item else {}
+    values = []
+    for index, resistance in enumerate(RESISTANCES):
+        if resistance.capitalize() in resistances:
+            flags |= _FLAG_HAS_RESISTANCE[index]
+            values.append(resistances[resistance.capitalize()])
+        else:
+            values.append(0)
+
+    return _RECORD.pack(item['id'], item.get('slot') or 0, flags, item.get('sockets') or 0, *values)
+
+
+def build_index_bytes(data_glob=ITEM_DATA_GLOB):
+    items = {}
+    for file_name in sorted(glob(data_glob)):
+        with open(file_name) as json_file:
+            data = json.load(json_file)
+            for item in [x for x in data if 'id' in x]:
+                items[item['id']] = item
+
+    records = [_pack_item(items[x]) for x in sorted(items.keys())]
+    return _HEADER.pack(_MAGIC, _VERSION, len(records)) + b''.join(records)
+
+
+def build_index(path=ITEM_INDEX_PATH, data_glob=ITEM_DATA_GLOB):
+    index_bytes = build_index_bytes(data_glob)
+    with open(path, 'wb') as index_file:
+        index_file.write(index_bytes)
+    return len(index_bytes)
+
+
+class ItemIndex:
+    def __init__(self, buffer):
+        magic, version, count = _HEADER.unpack_from(buffer, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('Unsupported item index (magic %r, version %d)' % (magic, version))
+
+        self._buffer = buffer
+        self._count = count
+
+    @staticmethod
+    def open(path=ITEM_INDEX_PATH):
+        if not os.path.exists(path):
+            print('Item index %s not found, building from %s' % (path, ITEM_DATA_GLOB))
+            return ItemIndex(build_index_bytes())
+
+        with open(path, 'rb') as index_file:
+            return ItemIndex(mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, item_id):
+        return self._find(item_id) is not None
+
+    def _find(self, item_id):
+        low = 0
+        high = self._count
+        while low < high:
+            middle = (low + high) // 2
+            offset = _HEADER.size + middle * _RECORD.size
+            middle_id = _ID.unpack_from(self._buffer, offset)[0]
+            if middle_id < item_id:
+                low = middle + 1
+            elif middle_id > item_id:
+                high = middle
+            else:
+                return offset
+
+        return None
+
+    def get(self, item_id):
+        offset = self._find(item_id)
+        if offset is None:
+            return None
+
+        (record_id, slot, flags, sockets, *resistances) = _RECORD.unpack_from(self._buffer, offset)
+        item = {
+            'id': record_id,
+            'slot': slot if flags & _FLAG_HAS_SLOT else None,
+            'randomEnchantment': True if flags & _FLAG_RANDOM_ENCHANTMENT else None,
+            'notEnchantable': bool(flags & _FLAG_NOT_ENCHANTABLE),
+            'sockets': sockets if flags & _FLAG_HAS_SOCKETS else None,
+        }
+        for index, resistance in enumerate(RESISTANCES):
+            item['resistance-' + resistance] = resistances[index] if flags & _FLAG_HAS_RESISTANCE[index] else None
+
+        return item
+
+
+def get_item_index():
+    global _item_index
+
+    if _item_index is None:
+        _item_index = ItemIndex.open()
+        _item_cache_stats['index_loads'] += 1
+
+    return _item_index
+
+
+def get_item(item_id):
+    if item_id in _item_cache:
+        _item_cache_stats['hits'] += 1
+        return _item_cache[item_id]
+
+    _item_cache_stats['misses'] += 1
+    item = get_item_index().get(item_id)
+    _item_cache[item_id] = item
+    return item
+
+
+def item_cache_stats():
+    return dict(_item_cache_stats, cached_items=len(_item_cache))
+
+
+if __name__ == '__main__':
+    print('Wrote %s (%d bytes)' % (ITEM_INDEX_PATH, build_index()))
@@ -0,0 +1,32 @@
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _json_dumps(obj):
+    return json.dumps(obj).encode('utf-8')
+
+
+# name -> (loads, dumps). loads takes bytes or str, dumps returns utf-8 bytes. Integer dict keys (character, ability
+# and gem ids) are written as strings by every codec, like json.dumps does
+CODECS = {'json': (json.loads, _json_dumps)}
+if orjson is not None:
+    CODECS['orjson'] = (orjson.loads, lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS))
+if msgspec is not None:
+    CODECS['msgspec'] = (msgspec.json.decode, msgspec.json.encode)
+
+# raised by the loads of every codec (and the event_schema decoders) for truncated or malformed documents
+DECODE_ERRORS = (ValueError,) if msgspec is None else (ValueError, msgspec.DecodeError)
+
+# the fastest available unless JSON_CODEC names one
+JSON_CODEC = os.environ.get('JSON_CODEC', next(x for x in ['orjson', 'msgspec', 'json'] if x in CODECS))
+(loads, dumps) = CODECS[JSON_CODEC]
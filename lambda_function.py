@@ -1,25 +1,372 @@
+import base64
 import json
 import platform
 import asyncio
 import re
+import time
+import uuid
 import wcl_parser
+import wcl_session
+import json_codec
+import report_store
+import report_lock
+import report_queue
+import instrumentation
 import boto3
 import os
-from botocore.errorfactory import ClientError
-from exceptions import NotFoundException
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from exceptions import NotFoundException, RequestException, DeadlineException
 
 
 S3_BUCKET = os.environ['S3_BUCKET']
 API_VERSION = 'v1.2'
+FETCH_MODE = os.environ.get('WCL_FETCH_MODE', wcl_parser.FETCH_MODE_AUTO)
+# wait: all fights are saved before responding, background: respond first and let the saves finish in the background.
+# Lambda freezes the container once it responded, so background writes only make progress during its later
+# invocations. A parse holding a lease other containers wait on (report_lock.S3ReportLock) always waits for its writes,
+# otherwise the lease would be held until it expires and the fights would be missing until then
+S3_WRITE_MODE = os.environ.get('S3_WRITE_MODE', 'wait')
+STORAGE_FORMAT = os.environ.get('S3_STORAGE_FORMAT', report_store.STORAGE_FORMAT_OBJECTS)
+# requests for a report another invocation is parsing poll for its result instead of parsing it again.
+# api gateway gives up after 29 seconds, so stop waiting before that and ask the client to retry
+REPORT_LOCK_WAIT = float(os.environ.get('REPORT_LOCK_WAIT', '25'))
+REPORT_LOCK_POLL = float(os.environ.get('REPORT_LOCK_POLL', '1'))
+# requests for a boss fight of an uncached report parse only that fight, under the report lock. defer: the rest of the
+# report is parsed when it is requested, invoke: this function is invoked asynchronously to parse the whole report.
+# Not with a queue (report_queue), the queue worker parses the whole report
+LAZY_FIGHT_PARSE = os.environ.get('LAZY_FIGHT_PARSE', '')
+# seconds of the invocation kept for to_json and the S3 writes (or the checkpoint) after the parse stopped
+DEADLINE_MARGIN = float(os.environ.get('DEADLINE_MARGIN', '5'))
+# invocations a parse may continue over (see wcl_parser.WCLParser.checkpoint) before it is given up
+CHECKPOINT_MAX_ROUNDS = int(os.environ.get('CHECKPOINT_MAX_ROUNDS', '10'))
+# a queued report whose status was not updated for this long is queued again (the message was lost or the worker
+# crashed), see report_queue
+REPORT_QUEUE_TTL = float(os.environ.get('REPORT_QUEUE_TTL', '900'))
 CONTENT_TYPE_PREFIX = "application/vnd.bixnpieces.logsummary-"
 CONTENT_TYPE_PATTERN = CONTENT_TYPE_PREFIX + "%s+json"
 
+# reused by every invocation in the container
+_s3_client = None
+_lambda_client = None
+_sqs_client = None
+_report_lock = None
+_report_queue = None
 
-def lambda_handler(event, context):
+
+def get_s3_client():
+    global _s3_client
+
+    if _s3_client is None:
+        _s3_client = boto3.client("s3", region_name='ap-southeast-2',
+                                  config=Config(max_pool_connections=report_store.S3_WRITE_WORKERS))
+
+    return _s3_client
+
+
+def get_lambda_client():
+    global _lambda_client
+
+    if _lambda_client is None:
+        _lambda_client = boto3.client("lambda", region_name='ap-southeast-2')
+
+    return _lambda_client
+
+
+def get_sqs_client():
+    global _sqs_client
+
+    if _sqs_client is None:
+        _sqs_client = boto3.client("sqs", region_name='ap-southeast-2')
+
+    return _sqs_client
+
+
+def get_report_queue():
+    global _report_queue
+
+    if _report_queue is None:
+        _report_queue = report_queue.create_report_queue(get_sqs_client)
+
+    return _report_queue
+
+
+def get_report_lock():
+    global _report_lock
+
+    if _report_lock is None:
+        _report_lock = report_lock.create_report_lock(get_s3_client(), S3_BUCKET)
+
+    return _report_lock
+
+
+def get_deadline(context):
+    # time.monotonic() by which the parser has to stop, None without a lambda context
+    get_remaining_time = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining_time is None:
+        return None
+
+    return time.monotonic() + get_remaining_time() / 1000 - DEADLINE_MARGIN
+
+
+def made_progress(previous, checkpoint):
+    # a round that finished no job and read no page is not continued by itself, only once the report is requested
+    # again. Otherwise a parse that can not get ahead within an invocation would keep invoking the function
+    return previous is None or previous['done'] != checkpoint['done'] or previous['streams'] != checkpoint['streams']
+
+
+def out_of_time_response(report_id):
+    return {
+        "statusCode": 503,
+        "headers": {"Retry-After": "%d" % max(1, REPORT_LOCK_POLL)},
+        "body": '%s is being parsed, try again shortly.' % report_id
+    }
+
+
+def wait_for_report(s3_client, lock, report_id, fight_id, encodings, context, refresh=False):
+    # (None, None) once the parse finished without storing the fight, or when it is still running at the deadline.
+    # a refresh reads the stored fight only after the other invocation is done updating it
+    deadline = time.monotonic() + REPORT_LOCK_WAIT
+    if get_deadline(context) is not None:
+        deadline = min(deadline, get_deadline(context))
+    while time.monotonic() < deadline:
+        time.sleep(max(0.0, min(REPORT_LOCK_POLL, deadline - time.monotonic())))
+        is_locked = lock.is_locked(report_id, API_VERSION)
+        if refresh and is_locked:
+            continue
+
+        (file_content, encoding) = report_store.load_fight(s3_client, S3_BUCKET, report_id, API_VERSION, fight_id,
+                                                           STORAGE_FORMAT, encodings)
+        if file_content is not None or not is_locked:
+            return file_content, encoding
+
+    return None, None
+
+
+def schedule_report_parse(report_id, context):
+    # the whole report is parsed by another invocation, so the other fights are cached by the time they are requested
+    queue = get_report_queue()
+    if queue is not None:
+        enqueue_report(get_s3_client(), queue, report_id, False)
+        return
+
+    function_name = getattr(context, 'function_name', None)
+    if function_name is None:
+        return
+
+    try:
+        get_lambda_client().invoke(FunctionName=function_name, InvocationType='Event',
+                                   Payload=json.dumps({"pathParameters": {"id": report_id, "fight": "-1"}}))
+    except ClientError as ex:
+        print('Could not schedule parsing %s - %s' % (report_id, ex))
+
+
+def parse_fight_lazily(s3_client, lock, report_id, fight_id, context):
+    # holding the report lock, so concurrent requests for the fight wait for this parse instead of repeating it
+    try:
+        response = run_parser(async_fight_handler(report_id, fight_id, get_deadline(context)))
+        if response is not None:
+            fight_response = response.to_json(fight_id)
+    except DeadlineException:
+        lock.release(report_id, API_VERSION)
+        return out_of_time_response(report_id)
+    except NotFoundException as ex:
+        lock.release(report_id, API_VERSION)
+        return {
+            "statusCode": 404,
+            "body": ex.message
+        }
+    except RequestException as ex:
+        lock.release(report_id, API_VERSION)
+        return {
+            "statusCode": 502,
+            "body": ex.message
+        }
+    except Exception:
+        lock.release(report_id, API_VERSION)
+        raise
+
+    if response is None:
+        lock.release(report_id, API_VERSION)
+        return {
+            "statusCode": 404,
+            "body": '%d is not a valid boss fight or summary identifier.' % fight_id
+        }
+
+    report_store.save_fights(s3_client, S3_BUCKET, report_id, API_VERSION, {fight_id: fight_response},
+                             wait=S3_WRITE_MODE != 'background' or lock.shared, storage_format=STORAGE_FORMAT,
+                             on_complete=lambda: lock.release(report_id, API_VERSION))
+    if LAZY_FIGHT_PARSE == 'invoke':
+        schedule_report_parse(report_id, context)
+
+    return {
+        "statusCode": 200,
+        "headers": {"contentType": CONTENT_TYPE_PATTERN % API_VERSION},
+        "body": json_codec.dumps(fight_response).decode('utf-8')
+    }
+
+
+def queue_report(s3_client, queue, report_id, fight_id, refresh, event):
+    # the worker (queue_handler) parses the report, the client polls the Location until the fight is stored. A refresh
+    # gets an id, the stored fight is the one before the refresh until it is done (see poll_refresh)
+    if fight_id != -1 and not refresh:
+        (summary, _) = report_store.load_fight(s3_client, S3_BUCKET, report_id, API_VERSION, -1, STORAGE_FORMAT)
+        if summary is not None:
+            return {
+                "statusCode": 404,
+                "body": '%d is not a valid boss fight or summary identifier.' % fight_id
+            }
+
+    # also a refresh requested while one is queued joins it
+    status = enqueue_report(s3_client, queue, report_id, refresh)
+    return queued_response(s3_client, queue, report_id, status, event)
+
+
+def enqueue_report(s3_client, queue, report_id, refresh):
+    # the status is written before the message is sent, requests and retries until the worker starts find it and
+    # do not queue the report again. Returns the status of the queued parse
+    status = report_store.load_status(s3_client, S3_BUCKET, report_id, API_VERSION)
+    if status is None:
+        status = {'status': 'queued', 'refresh': uuid.uuid4().hex if refresh else None, 'updated': time.time()}
+        report_store.save_status(s3_client, S3_BUCKET, report_id, API_VERSION, status)
+        queue.send(report_id, status['refresh'])
+        instrumentation.set_property('queued', True)
+    return status
+
+
+def poll_refresh(s3_client, queue, report_id, refresh_id, event):
+    # None once the refresh is done, then the fight is read again from S3 like for any other request. Also for an
+    # unknown id
+    status = report_store.load_status(s3_client, S3_BUCKET, report_id, API_VERSION)
+    if status is None or status.get('refresh') != refresh_id:
+        # another container updated the report, what is cached here is from before
+        report_store.invalidate_report(report_id, API_VERSION)
+        return None
+
+    return queued_response(s3_client, queue, report_id, status, event)
+
+
+def queued_response(s3_client, queue, report_id, status, event):
+    if status['status'] == 'failed':
+        # reported once, the next request queues the report again
+        report_store.delete_status(s3_client, S3_BUCKET, report_id, API_VERSION)
+        return {
+            "statusCode": status['statusCode'],
+            "body": status['body']
+        }
+
+    if status['updated'] + REPORT_QUEUE_TTL < time.time():
+        # the message was lost or the worker kept crashing
+        status = dict(status, status='queued', updated=time.time())
+        report_store.save_status(s3_client, S3_BUCKET, report_id, API_VERSION, status)
+        queue.send(report_id, status.get('refresh'))
+        instrumentation.set_property('queued', True)
+
+    headers = {"Retry-After": "%d" % max(1, REPORT_LOCK_POLL)}
+    if event.get('path'):
+        # a refresh is polled under its id, the path alone returns the fight stored before it
+        headers['Location'] = event['path'] + ('?refresh=%s' % status['refresh'] if status.get('refresh') else '')
+    return {
+        "statusCode": 202,
+        "headers": headers,
+        "body": '%s is %s, try again shortly.' % (report_id, 'being parsed' if status['status'] == 'parsing'
+                                                  else 'queued for parsing')
+    }
+
+
+def accepted_encodings(headers):
+    encodings = []
+    for value in headers.get('Accept-Encoding', headers.get('accept-encoding', '')).split(','):
+        (encoding, _, parameters) = value.partition(';')
+        parameters = parameters.replace(' ', '')
+        try:
+            quality = float(parameters[2:]) if parameters.startswith('q=') else 1
+        except ValueError:
+            quality = 1
+        if encoding.strip() != '' and quality > 0:
+            encodings.append(encoding.strip().lower())
+    return encodings
+
+
+def cached_response(file_content, encoding, version):
+    # stored documents are returned as they are, without decoding and encoding them again. Caches in front of the api
+    # must key them by the encodings the client accepts. Compressed ones need binaryMediaTypes on the api, see
+    # report_store.PRECOMPRESSED_ENCODINGS
+    headers = {"content-type": CONTENT_TYPE_PATTERN % version, "Vary": "Accept-Encoding"}
+    if encoding == report_store.ENCODING_IDENTITY:
+        return {
+            "statusCode": 200,
+            "headers": headers,
+            "body": file_content.decode('utf-8')
+        }
+
+    headers['Content-Encoding'] = encoding
+    return {
+        "statusCode": 200,
+        "headers": headers,
+        "body": base64.b64encode(file_content).decode('ascii'),
+        "isBase64Encoded": True
+    }
+
+
+def lambda_handler(event, context, worker=False):
+    # one line of metrics per invocation (per report for the queue worker), see instrumentation
+    instrumentation.reset()
+    response = None
+    try:
+        with instrumentation.timer('total'):
+            response = handle_request(event, context, worker)
+        return response
+    finally:
+        instrumentation.emit(status=response['statusCode'] if response is not None else 500,
+                             write_mode=S3_WRITE_MODE, storage_format=STORAGE_FORMAT, worker=worker,
+                             response_cache=report_store.response_cache_stats())
+
+
+def queue_handler(event, context):
+    # the worker of report_queue, for an SQS event source with ReportBatchItemFailures. Reports that ran out of time
+    # (or that another invocation is still parsing) are queued again, a failed parse is left as the status the
+    # queued requests return. The status keeps the id of a refresh, its requests poll under it
+    s3_client = get_s3_client()
+    batch_item_failures = []
+    for record in event['Records']:
+        message = json.loads(record['body'])
+        report_id = message['id']
+        refresh_id = message['refresh']
+        try:
+            report_store.save_status(s3_client, S3_BUCKET, report_id, API_VERSION,
+                                     {'status': 'parsing', 'refresh': refresh_id, 'updated': time.time()})
+            response = lambda_handler({"pathParameters": {"id": report_id, "fight": "-1"},
+                                       "queryStringParameters": {"refresh": "1" if refresh_id else ""}},
+                                      context, worker=True)
+            if response['statusCode'] == 200:
+                # the fights have to be readable before the requests stop waiting for them
+                report_store.flush_pending_writes()
+                report_store.delete_status(s3_client, S3_BUCKET, report_id, API_VERSION)
+            elif response['statusCode'] == 503:
+                report_store.save_status(s3_client, S3_BUCKET, report_id, API_VERSION,
+                                         {'status': 'queued', 'refresh': refresh_id, 'updated': time.time()})
+                get_report_queue().send(report_id, refresh_id)
+            else:
+                report_store.save_status(s3_client, S3_BUCKET, report_id, API_VERSION,
+                                         {'status': 'failed', 'refresh': refresh_id, 'updated': time.time(),
+                                          'statusCode': response['statusCode'], 'body': response['body']})
+        except Exception as ex:
+            # the message is received again after its visibility timeout
+            print('Could not parse %s - %r' % (report_id, ex))
+            report_store.save_status(s3_client, S3_BUCKET, report_id, API_VERSION,
+                                     {'status': 'queued', 'refresh': refresh_id, 'updated': time.time()})
+            batch_item_failures.append({"itemIdentifier": record['messageId']})
+
+    return {"batchItemFailures": batch_item_failures}
+
+
+def handle_request(event, context, worker=False):
     params = event['pathParameters']
     report_id = ''
     fight_id = -1
     request_version = API_VERSION
+    encodings = accepted_encodings(event['headers']) if 'headers' in event and event['headers'] else []
 
     if 'headers' in event and 'Accept' in event['headers']:
         content_type = event['headers']['Accept']
@@ -32,6 +379,17 @@ def lambda_handler(event, context):
     if 'fight' in params:
         fight_id = int(params['fight'])
 
+    # ?refresh=1 updates a cached report with the fights uploaded since it was parsed
+    query = event.get('queryStringParameters') or {}
+    refresh = query.get('refresh', '').lower() in ['1', 'true']
+    # with a queue (see queue_report) a refresh is polled as ?refresh=<its id>
+    refresh_id = query.get('refresh') if query.get('refresh', '').lower() not in ['', '0', 'false', '1', 'true'] \
+        else None
+
+    instrumentation.set_property('report_id', report_id)
+    instrumentation.set_property('fight_id', fight_id)
+    instrumentation.set_property('refresh', refresh)
+
     if re.fullmatch('(?a:[a-zA-Z0-9]{16})', report_id) is None:
         return {
             "statusCode": 400,
@@ -41,57 +399,149 @@ def lambda_handler(event, context):
     if platform.system() == 'Windows':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+    report_store.flush_pending_writes()
+
     # check s3 bucket
-    s3_client = boto3.resource("s3", region_name='ap-southeast-2')
+    s3_client = get_s3_client()
 
-    # try requested version
-    object_key = '%s/%s/fight%d.json' % (report_id, request_version, fight_id) # replace object key
-    try:
-        file_content = s3_client.Object(S3_BUCKET, object_key).get()["Body"].read()
-        file_json = json.loads(file_content)
-        return {
-            "statusCode": 200,
-            "headers": {"content-type": CONTENT_TYPE_PATTERN % request_version},
-            "body": json.dumps(file_json)
-        }
-    except ClientError as e:
-        print("Did not read %s from cache %s - %s" % (request_version, object_key, e))
+    queue = get_report_queue() if not worker else None
+    if queue is not None and refresh_id is not None:
+        response = poll_refresh(s3_client, queue, report_id, refresh_id, event)
+        if response is not None:
+            return response
 
-    # if different from current version, try get cached current version
-    if request_version != API_VERSION:
-        object_key = '%s/%s/fight%d.json' % (report_id, API_VERSION, fight_id) # replace object key
-        try:
-            file_content = s3_client.Object(S3_BUCKET, object_key).get()["Body"].read()
-            file_json = json.loads(file_content)
+    if refresh:
+        # another container may have updated the report since it was cached here
+        report_store.invalidate_report(report_id, API_VERSION)
+    else:
+        with instrumentation.timer('s3_get'):
+            # try requested version
+            (file_content, encoding) = report_store.load_fight(s3_client, S3_BUCKET, report_id, request_version,
+                                                               fight_id, STORAGE_FORMAT, encodings)
+            if file_content is None and request_version != API_VERSION:
+                # if different from current version, try get cached current version
+                request_version = API_VERSION
+                (file_content, encoding) = report_store.load_fight(s3_client, S3_BUCKET, report_id, API_VERSION,
+                                                                   fight_id, STORAGE_FORMAT, encodings)
+
+        if file_content is not None:
+            return cached_response(file_content, encoding, request_version)
+
+    # with a queue the whole report is queued instead
+    if queue is not None:
+        return queue_report(s3_client, queue, report_id, fight_id, refresh, event)
+
+    # only one invocation parses a report at a time
+    lock = get_report_lock()
+    if not lock.acquire(report_id, API_VERSION):
+        print('%s is being parsed by another invocation, waiting for it' % report_id)
+        (file_content, encoding) = wait_for_report(s3_client, lock, report_id, fight_id, encodings, context,
+                                                   refresh)
+        if file_content is not None:
+            return cached_response(file_content, encoding, API_VERSION)
+
+        if lock.is_locked(report_id, API_VERSION):
+            return out_of_time_response(report_id)
+
+        (summary, _) = report_store.load_fight(s3_client, S3_BUCKET, report_id, API_VERSION, -1, STORAGE_FORMAT)
+        if summary is not None:
             return {
-                "statusCode": 200,
-                "headers": {"content-type": CONTENT_TYPE_PATTERN % API_VERSION},
-                "body": json.dumps(file_json)
+                "statusCode": 404,
+                "body": '%d is not a valid boss fight or summary identifier.' % fight_id
             }
-        except ClientError as e:
-            print("Did not read %s from cache %s - %s" % (API_VERSION, object_key, e))
 
+        # the other parse failed, try it here. Unless another invocation was quicker
+        if not lock.acquire(report_id, API_VERSION):
+            return out_of_time_response(report_id)
+
+    # packed reports are always written whole
+    if LAZY_FIGHT_PARSE != '' and fight_id > 0 and not refresh \
+            and STORAGE_FORMAT == report_store.STORAGE_FORMAT_OBJECTS:
+        return parse_fight_lazily(s3_client, lock, report_id, fight_id, context)
+
+    # a parse that ran out of time is continued from its checkpoint
+    deadline = get_deadline(context)
+    state = report_store.load_state(s3_client, S3_BUCKET, report_id, API_VERSION) if refresh else None
+    checkpoint = report_store.load_checkpoint(s3_client, S3_BUCKET, report_id, API_VERSION) if state is None else None
     try:
-        response = asyncio.run(async_handler(report_id))
+        if state is None:
+            response = run_parser(async_handler(report_id, checkpoint, deadline))
+        else:
+            response = run_parser(async_update_handler(report_id, state, deadline))
+
+        if response is not None and response.checkpoint is None:
+            fight_ids = [x['id'] for x in response.fights.values() if x['boss'] > 0]
+            fight_ids.append(-1)    # summary
+            fight_ids.append(0)     # trash
+            with instrumentation.timer('to_json'):
+                fights = {fight: response.to_json(fight) for fight in fight_ids}
     except NotFoundException as ex:
+        lock.release(report_id, API_VERSION)
         return {
             "statusCode": 404,
             "body": ex.message
         }
+    except RequestException as ex:
+        # warcraftlogs kept failing or throttling after the retries
+        lock.release(report_id, API_VERSION)
+        return {
+            "statusCode": 502,
+            "body": ex.message
+        }
+    except DeadlineException:
+        # only an update or the fights request itself, their progress is not kept
+        lock.release(report_id, API_VERSION)
+        return out_of_time_response(report_id)
+    except Exception:
+        lock.release(report_id, API_VERSION)
+        raise
+
+    if response is None:
+        # nothing was uploaded since the report was cached
+        lock.release(report_id, API_VERSION)
+        (file_content, encoding) = report_store.load_fight(s3_client, S3_BUCKET, report_id, API_VERSION, fight_id,
+                                                           STORAGE_FORMAT, encodings)
+        if file_content is not None:
+            return cached_response(file_content, encoding, API_VERSION)
+
+        return {
+            "statusCode": 404,
+            "body": '%d is not a valid boss fight or summary identifier.' % fight_id
+        }
 
-    # save to s3 bucket
-    fight_response = None
-    fight_ids = [x['id'] for x in response.fights.values() if x['boss'] > 0]
-    fight_ids.append(-1)    # summary
-    fight_ids.append(0)     # trash
-    for fight in fight_ids:
-        fight_data = response.to_json(fight)
-        if fight == fight_id:
-            fight_response = fight_data
+    if response.checkpoint is not None:
+        # another invocation continues the parse, the client retries until it is done
+        instrumentation.set_property('checkpoint', len(response.checkpoint['done']))
+        if response.checkpoint['rounds'] >= CHECKPOINT_MAX_ROUNDS:
+            report_store.delete_checkpoint(s3_client, S3_BUCKET, report_id, API_VERSION)
+            lock.release(report_id, API_VERSION)
+            return {
+                "statusCode": 504,
+                "body": '%s could not be parsed within %d invocations.' % (report_id, response.checkpoint['rounds'])
+            }
+
+        report_store.save_checkpoint(s3_client, S3_BUCKET, report_id, API_VERSION, response.checkpoint)
+        lock.release(report_id, API_VERSION)
+        if not worker and made_progress(checkpoint, response.checkpoint):
+            # the queue worker sends its message again
+            schedule_report_parse(report_id, context)
+        return out_of_time_response(report_id)
 
-        # save to s3 bucket
-        save_key = '%s/%s/fight%d.json' % (report_id, API_VERSION, fight)
-        s3_client.Object(S3_BUCKET, save_key).put(Body=json.dumps(fight_data))
+    def on_complete():
+        if checkpoint is not None:
+            report_store.delete_checkpoint(s3_client, S3_BUCKET, report_id, API_VERSION)
+        lock.release(report_id, API_VERSION)
+
+    # save to s3 bucket, the lock is held until the fights can be read back. In background mode this only times
+    # handing the writes over. Partial results (see wcl_parser.PARTIAL_RESULTS) are saved without their state, so a
+    # refresh parses the report again instead of continuing from the incomplete sections
+    instrumentation.set_property('incomplete', sorted(response.incomplete.keys()))
+    state = response.get_state() if len(response.incomplete) == 0 else None
+    with instrumentation.timer('s3_put'):
+        report_store.save_fights(s3_client, S3_BUCKET, report_id, API_VERSION, fights,
+                                 wait=S3_WRITE_MODE != 'background' or lock.shared, storage_format=STORAGE_FORMAT,
+                                 on_complete=on_complete, state=state)
+    fight_response = fights.get(fight_id)
 
     if fight_response is None:
         return {
@@ -102,13 +552,37 @@ def lambda_handler(event, context):
     return {
         "statusCode": 200,
         "headers": {"contentType": CONTENT_TYPE_PATTERN % API_VERSION},
-        "body": json.dumps(fight_response)
+        "body": json_codec.dumps(fight_response).decode('utf-8')
     }
 
 
-async def async_handler(report_id):
-    async with wcl_parser.WCLParser(report_id) as parser:
-        return await parser.parse_report()
+def run_parser(coroutine):
+    try:
+        with instrumentation.timer('parse'):
+            return wcl_session.run(coroutine)
+    finally:
+        instrumentation.set_property('connections', wcl_session.connection_stats())
+
+
+def create_parser(report_id, deadline=None):
+    # the connections to warcraftlogs are kept for the next invocations
+    session = wcl_session.get_session(wcl_parser.WCLParser.BASE_DOMAIN, wcl_parser.WCLParser.MAX_IN_FLIGHT)
+    return wcl_parser.WCLParser(report_id, FETCH_MODE, session, deadline=deadline)
+
+
+async def async_handler(report_id, checkpoint=None, deadline=None):
+    async with create_parser(report_id, deadline) as parser:
+        return await parser.parse_report(checkpoint)
+
+
+async def async_fight_handler(report_id, fight_id, deadline=None):
+    async with create_parser(report_id, deadline) as parser:
+        return await parser.parse_fight(fight_id)
+
+
+async def async_update_handler(report_id, state, deadline=None):
+    async with create_parser(report_id, deadline) as parser:
+        return await parser.update_report(state)
 
 if __name__ == '__main__':
     # print(lambda_handler({"pathParameters": {"id": "MhmWRGb23rJ4DX9F", "fight": "-1"}}, {}))
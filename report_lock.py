@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+import time
+from botocore.exceptions import ClientError
+
+
+# s3: conditional put of a marker object, shared by every container. local: only this process, for local runs
+REPORT_LOCK = os.environ.get('REPORT_LOCK', 's3')
+# a lease older than this is considered abandoned (the parsing invocation timed out or crashed)
+REPORT_LOCK_TTL = int(os.environ.get('REPORT_LOCK_TTL', '900'))
+
+
+def lock_key(report_id, version):
+    return '%s/%s/parsing.lock' % (report_id, version)
+
+
+def _lost_race(e):
+    # a conditional write that found the lease changed since it was read
+    return e.response['Error']['Code'] in ['PreconditionFailed', 'ConditionalRequestConflict', 'NoSuchKey']
+
+
+class S3ReportLock:
+    # other containers wait on the lease, so it must not be left to a frozen container
+    shared = True
+
+    def __init__(self, s3_client, bucket, ttl=REPORT_LOCK_TTL):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.ttl = ttl
+        # (report id, version) -> etag of the leases written here
+        self._leases = {}
+
+    def _put_lease(self, report_id, version, expires, **conditions):
+        response = self.s3_client.put_object(Bucket=self.bucket, Key=lock_key(report_id, version),
+                                             Body=json.dumps({'expires': expires}), **conditions)
+        return response['ETag']
+
+    def _get_lease(self, report_id, version):
+        # (expires, etag), None if there is no lease
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=lock_key(report_id, version))
+            return json.loads(response['Body'].read())['expires'], response['ETag']
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return None
+            raise
+
+    def acquire(self, report_id, version):
+        # a lease that expired (or was released) is replaced only if it is still the one that was read, so of two
+        # invocations taking it over at the same time one fails
+        try:
+            self._leases[(report_id, version)] = self._put_lease(report_id, version, time.time() + self.ttl,
+                                                                 IfNoneMatch='*')
+            return True
+        except ClientError as e:
+            if not _lost_race(e):
+                raise
+
+        lease = self._get_lease(report_id, version)
+        if lease is None or lease[0] > time.time():
+            return False
+
+        try:
+            self._leases[(report_id, version)] = self._put_lease(report_id, version, time.time() + self.ttl,
+                                                                 IfMatch=lease[1])
+            return True
+        except ClientError as e:
+            if not _lost_race(e):
+                raise
+            return False
+
+    def is_locked(self, report_id, version):
+        lease = self._get_lease(report_id, version)
+        return lease is not None and lease[0] > time.time()
+
+    def release(self, report_id, version):
+        # expires the lease written here, unless it already expired and was taken over by another invocation. It is
+        # not deleted: a delete could remove the lease of an invocation that took it over in between
+        etag = self._leases.pop((report_id, version), None)
+        if etag is None:
+            return
+
+        try:
+            self._put_lease(report_id, version, 0, IfMatch=etag)
+        except ClientError as e:
+            if not _lost_race(e):
+                raise
+            print('Lease of %s %s was taken over by another invocation' % (version, report_id))
+
+
+class LocalReportLock:
+    shared = False
+
+    def __init__(self, ttl=REPORT_LOCK_TTL):
+        self.ttl = ttl
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, report_id, version):
+        with self._lock:
+            if self._leases.get((report_id, version), 0) > time.time():
+                return False
+
+            self._leases[(report_id, version)] = time.time() + self.ttl
+            return True
+
+    def is_locked(self, report_id, version):
+        with self._lock:
+            return self._leases.get((report_id, version), 0) > time.time()
+
+    def release(self, report_id, version):
+        with self._lock:
+            self._leases.pop((report_id, version), None)
+
+
+class NoReportLock:
+    shared = False
+
+    def acquire(self, report_id, version):
+        return True
+
+    def is_locked(self, report_id, version):
+        return False
+
+    def release(self, report_id, version):
+        pass
+
+
+def create_report_lock(s3_client, bucket, backend=REPORT_LOCK):
+    if backend == 's3':
+        return S3ReportLock(s3_client, bucket)
+    if backend == 'local':
+        return LocalReportLock()
+    return NoReportLock()
@@ -0,0 +1,53 @@
+import collections
+import json
+import os
+import threading
+import uuid
+
+
+# sqs: reports missing from the cache are parsed by the queue worker (lambda_function.queue_handler) and requests are
+# answered with 202 until they are stored. local: an in process queue the caller drains, for local runs.
+# Empty: requests parse the report themselves
+REPORT_QUEUE = os.environ.get('REPORT_QUEUE', '')
+SQS_QUEUE_URL = os.environ.get('SQS_QUEUE_URL', '')
+
+
+def message_body(report_id, refresh):
+    # refresh: the id of a queued refresh (see lambda_function.queue_report), None to parse the report
+    return json.dumps({'id': report_id, 'refresh': refresh})
+
+
+class SqsReportQueue:
+    def __init__(self, sqs_client, queue_url=SQS_QUEUE_URL):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+
+    def send(self, report_id, refresh=None):
+        self.sqs_client.send_message(QueueUrl=self.queue_url, MessageBody=message_body(report_id, refresh))
+
+
+class LocalReportQueue:
+    def __init__(self):
+        self._messages = collections.deque()
+        self._lock = threading.Lock()
+
+    def send(self, report_id, refresh=None):
+        with self._lock:
+            self._messages.append({'messageId': str(uuid.uuid4()), 'body': message_body(report_id, refresh)})
+
+    def receive(self, max_messages=10):
+        # records shaped like those of an SQS event
+        with self._lock:
+            return [self._messages.popleft() for _ in range(min(max_messages, len(self._messages)))]
+
+    def __len__(self):
+        return len(self._messages)
+
+
+def create_report_queue(sqs_client_factory, backend=REPORT_QUEUE):
+    # None when reports are parsed by the requests themselves
+    if backend == 'sqs':
+        return SqsReportQueue(sqs_client_factory())
+    if backend == 'local':
+        return LocalReportQueue()
+    return None
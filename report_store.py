@@ -0,0 +1,327 @@
+import functools
+import gzip
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from botocore.exceptions import ClientError
+import json_codec
+from response_cache import ResponseCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+S3_WRITE_WORKERS = int(os.environ.get('S3_WRITE_WORKERS', '8'))
+# in memory cache of stored documents in front of S3, keyed by (report id, version, fight id, encoding)
+RESPONSE_CACHE_BYTES = int(os.environ.get('RESPONSE_CACHE_BYTES', str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '300'))
+# objects: one object per fight, packed: one object per report holding every fight, read with ranged GETs
+STORAGE_FORMAT_OBJECTS = 'objects'
+STORAGE_FORMAT_PACKED = 'packed'
+# first ranged GET of a packed report, covers the header and usually the summary that is written right after it
+PACK_PREFETCH_BYTES = int(os.environ.get('PACK_PREFETCH_BYTES', '65536'))
+
+ENCODING_IDENTITY = 'identity'
+# the default quality of 11 takes seconds for a large report, while the parse waits for its writes
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '4'))
+_ENCODERS = {
+    'gzip': lambda x: gzip.compress(x, 6),
+}
+if brotli is not None:
+    _ENCODERS['br'] = functools.partial(brotli.compress, quality=BROTLI_QUALITY)
+_ENCODING_EXTENSIONS = {'gzip': '.gz', 'br': '.br'}
+# compressed representations stored alongside every fight document (e.g. br,gzip), served in this order of
+# preference. Off by default: they are returned base64 encoded (lambda_function.cached_response), which api gateway
+# only decodes for clients when binaryMediaTypes covers the content type, e.g. */*
+PRECOMPRESSED_ENCODINGS = [x for x in ['br', 'gzip']
+                           if x in _ENCODERS and x in os.environ.get('S3_PRECOMPRESS', '').split(',')]
+
+# packed report: magic, index length, index json ({fight id: [offset, length]} relative to the end of the index,
+# compressed representations under "<encoding>:<fight id>"), followed by the fight documents
+_PACK_MAGIC = b'WCLP'
+_PACK_HEADER = struct.Struct('<4sI')
+
+# shared by every invocation in the container, so background writes survive the handler returning
+_write_executor = ThreadPoolExecutor(max_workers=S3_WRITE_WORKERS, thread_name_prefix='s3-write')
+_pending_writes = []
+# also holds the (data offset, index, etag) of packed reports read by this container, under (report id, version,
+# PACKED_INDEX)
+_response_cache = ResponseCache(RESPONSE_CACHE_BYTES, RESPONSE_CACHE_TTL)
+PACKED_INDEX = 'index'
+
+
+def fight_key(report_id, version, fight_id, encoding=ENCODING_IDENTITY):
+    return '%s/%s/fight%d.json%s' % (report_id, version, fight_id, _ENCODING_EXTENSIONS.get(encoding, ''))
+
+
+def encode_fight(fight_data):
+    document = json_codec.dumps(fight_data)
+    encoded = {ENCODING_IDENTITY: document}
+    for encoding in PRECOMPRESSED_ENCODINGS:
+        encoded[encoding] = _ENCODERS[encoding](document)
+    return encoded
+
+
+def _index_key(fight_id, encoding):
+    return str(fight_id) if encoding == ENCODING_IDENTITY else '%s:%d' % (encoding, fight_id)
+
+
+def _served_encodings(accept_encodings):
+    return [x for x in PRECOMPRESSED_ENCODINGS if x in accept_encodings] + [ENCODING_IDENTITY]
+
+
+def state_key(report_id, version):
+    return '%s/%s/state.json.gz' % (report_id, version)
+
+
+def checkpoint_key(report_id, version):
+    return '%s/%s/checkpoint.json.gz' % (report_id, version)
+
+
+def status_key(report_id, version):
+    return '%s/%s/status.json' % (report_id, version)
+
+
+def packed_key(report_id, version):
+    return '%s/%s/report.pack' % (report_id, version)
+
+
+def pack_fights(encoded_fights):
+    # summary first, so it is usually covered by the prefetch of the header
+    documents = []
+    index = {}
+    offset = 0
+    for fight_id in sorted(encoded_fights.keys(), key=lambda x: (x != -1, x)):
+        for encoding, document in encoded_fights[fight_id].items():
+            index[_index_key(fight_id, encoding)] = [offset, len(document)]
+            documents.append(document)
+            offset += len(document)
+
+    index_json = json_codec.dumps(index)
+    return _PACK_HEADER.pack(_PACK_MAGIC, len(index_json)) + index_json + b''.join(documents)
+
+
+def _read_range(s3_client, bucket, key, start, length, etag=None):
+    # with an etag the read fails with PreconditionFailed once the object was replaced
+    conditions = {} if etag is None else {'IfMatch': etag}
+    response = s3_client.get_object(Bucket=bucket, Key=key, Range='bytes=%d-%d' % (start, start + length - 1),
+                                    **conditions)
+    return response['Body'].read(), response['ETag']
+
+
+def _load_packed_fight(s3_client, bucket, report_id, version, fight_id, accept_encodings):
+    try:
+        return _read_packed_fight(s3_client, bucket, report_id, version, fight_id, accept_encodings)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'PreconditionFailed':
+            raise
+
+    # another container stored the report again since its index was read here
+    invalidate_report(report_id, version)
+    return _read_packed_fight(s3_client, bucket, report_id, version, fight_id, accept_encodings)
+
+
+def _read_packed_fight(s3_client, bucket, report_id, version, fight_id, accept_encodings):
+    key = packed_key(report_id, version)
+    prefetch = None
+    packed_index = _response_cache.get((report_id, version, PACKED_INDEX))
+    if packed_index is None:
+        (prefetch, etag) = _read_range(s3_client, bucket, key, 0, PACK_PREFETCH_BYTES)
+        (magic, index_length) = _PACK_HEADER.unpack_from(prefetch, 0)
+        if magic != _PACK_MAGIC:
+            raise ValueError('%s is not a packed report' % key)
+        if _PACK_HEADER.size + index_length > len(prefetch):
+            (rest, _) = _read_range(s3_client, bucket, key, len(prefetch),
+                                    _PACK_HEADER.size + index_length - len(prefetch), etag)
+            prefetch = prefetch + rest
+
+        index = json_codec.loads(prefetch[_PACK_HEADER.size:_PACK_HEADER.size + index_length])
+        packed_index = (_PACK_HEADER.size + index_length, index, etag)
+        _response_cache.put((report_id, version, PACKED_INDEX), packed_index, index_length)
+
+    (data_offset, index, etag) = packed_index
+    for encoding in _served_encodings(accept_encodings):
+        if _index_key(fight_id, encoding) not in index:
+            continue
+
+        (offset, length) = index[_index_key(fight_id, encoding)]
+        start = data_offset + offset
+        if prefetch is not None and start + length <= len(prefetch):
+            return prefetch[start:start + length], encoding
+
+        (file_content, _) = _read_range(s3_client, bucket, key, start, length, etag)
+        return file_content, encoding
+
+    return None, None
+
+
+def _load_fight_object(s3_client, bucket, report_id, version, fight_id, accept_encodings):
+    for encoding in _served_encodings(accept_encodings):
+        try:
+            response = s3_client.get_object(Bucket=bucket, Key=fight_key(report_id, version, fight_id, encoding))
+            return response['Body'].read(), encoding
+        except ClientError as e:
+            # reports cached before compressed representations were stored only have the plain document
+            if encoding == ENCODING_IDENTITY or e.response['Error']['Code'] != 'NoSuchKey':
+                raise
+
+
+def load_fight(s3_client, bucket, report_id, version, fight_id, storage_format=STORAGE_FORMAT_OBJECTS,
+               accept_encodings=()):
+    # returns the stored json document of a fight, in the first stored encoding the client accepts, and that
+    # encoding. (None, None) if it is not cached
+    for encoding in _served_encodings(accept_encodings):
+        file_content = _response_cache.get((report_id, version, fight_id, encoding))
+        if file_content is not None:
+            return file_content, encoding
+
+    try:
+        if storage_format == STORAGE_FORMAT_PACKED:
+            (file_content, encoding) = _load_packed_fight(s3_client, bucket, report_id, version, fight_id,
+                                                          accept_encodings)
+        else:
+            (file_content, encoding) = _load_fight_object(s3_client, bucket, report_id, version, fight_id,
+                                                          accept_encodings)
+    except ClientError as e:
+        print("Did not read %s from cache %s fight %d - %s" % (version, report_id, fight_id, e))
+        return None, None
+
+    if file_content is not None:
+        _response_cache.put((report_id, version, fight_id, encoding), file_content)
+    return file_content, encoding
+
+
+def load_state(s3_client, bucket, report_id, version):
+    # the parser state saved with the fights, None for reports saved without one
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=state_key(report_id, version))
+        return json_codec.loads(gzip.decompress(response['Body'].read()))
+    except ClientError as e:
+        print("Did not read %s state of %s - %s" % (version, report_id, e))
+        return None
+
+
+def load_checkpoint(s3_client, bucket, report_id, version):
+    # the progress of a parse that ran out of time, None if there is none
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=checkpoint_key(report_id, version))
+        return json_codec.loads(gzip.decompress(response['Body'].read()))
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            print("Did not read %s checkpoint of %s - %s" % (version, report_id, e))
+        return None
+
+
+def save_checkpoint(s3_client, bucket, report_id, version, checkpoint):
+    s3_client.put_object(Bucket=bucket, Key=checkpoint_key(report_id, version),
+                         Body=gzip.compress(json_codec.dumps(checkpoint), 6))
+
+
+def delete_checkpoint(s3_client, bucket, report_id, version):
+    try:
+        s3_client.delete_object(Bucket=bucket, Key=checkpoint_key(report_id, version))
+    except ClientError as e:
+        print("Did not delete %s checkpoint of %s - %s" % (version, report_id, e))
+
+
+def load_status(s3_client, bucket, report_id, version):
+    # the status of a queued parse (see lambda_function.queue_handler), None if none is queued or it finished
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=status_key(report_id, version))
+        return json_codec.loads(response['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            print("Did not read %s status of %s - %s" % (version, report_id, e))
+        return None
+
+
+def save_status(s3_client, bucket, report_id, version, status):
+    s3_client.put_object(Bucket=bucket, Key=status_key(report_id, version), Body=json_codec.dumps(status),
+                         ContentType='application/json')
+
+
+def delete_status(s3_client, bucket, report_id, version):
+    try:
+        s3_client.delete_object(Bucket=bucket, Key=status_key(report_id, version))
+    except ClientError as e:
+        print("Did not delete %s status of %s - %s" % (version, report_id, e))
+
+
+def response_cache_stats():
+    return _response_cache.stats()
+
+
+def invalidate_report(report_id, version):
+    _response_cache.invalidate(lambda x: x[0] == report_id and x[1] == version)
+
+
+def _cache_fight(report_id, version, fight_id, encoded_fight):
+    for encoding, document in encoded_fight.items():
+        _response_cache.put((report_id, version, fight_id, encoding), document)
+
+
+def _put_packed(s3_client, bucket, report_id, version, fights):
+    encoded_fights = {fight_id: encode_fight(data) for fight_id, data in fights.items()}
+    s3_client.put_object(Bucket=bucket, Key=packed_key(report_id, version), Body=pack_fights(encoded_fights))
+    for fight_id, encoded_fight in encoded_fights.items():
+        _cache_fight(report_id, version, fight_id, encoded_fight)
+    return packed_key(report_id, version)
+
+
+def _put_fight(s3_client, bucket, report_id, version, fight_id, fight_data):
+    encoded_fight = encode_fight(fight_data)
+    for encoding, document in encoded_fight.items():
+        s3_client.put_object(Bucket=bucket, Key=fight_key(report_id, version, fight_id, encoding), Body=document)
+    _cache_fight(report_id, version, fight_id, encoded_fight)
+    return fight_key(report_id, version, fight_id)
+
+
+def _after_writes(futures, on_complete):
+    wait_futures(futures)
+    on_complete()
+
+
+def _put_state(s3_client, bucket, report_id, version, state):
+    s3_client.put_object(Bucket=bucket, Key=state_key(report_id, version),
+                         Body=gzip.compress(json_codec.dumps(state), 6))
+    return state_key(report_id, version)
+
+
+def save_fights(s3_client, bucket, report_id, version, fights, wait=True, storage_format=STORAGE_FORMAT_OBJECTS,
+                on_complete=None, state=None):
+    # s3_client must be a (thread safe) low level client, fights maps fight id to its json document.
+    # on_complete is called once every write has finished, whether it succeeded or not
+    invalidate_report(report_id, version)
+    if storage_format == STORAGE_FORMAT_PACKED:
+        futures = [_write_executor.submit(_put_packed, s3_client, bucket, report_id, version, fights)]
+    else:
+        futures = [_write_executor.submit(_put_fight, s3_client, bucket, report_id, version, fight_id, data)
+                   for fight_id, data in fights.items()]
+    if state is not None:
+        futures.append(_write_executor.submit(_put_state, s3_client, bucket, report_id, version, state))
+
+    if wait:
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            if on_complete is not None:
+                on_complete()
+    else:
+        _pending_writes.extend(futures)
+        if on_complete is not None:
+            # submitted after the writes, so it only starts waiting once all of them have been picked up
+            _pending_writes.append(_write_executor.submit(_after_writes, futures, on_complete))
+
+
+def flush_pending_writes():
+    # background writes from a previous invocation only run while the container is thawed, so check on them here
+    futures = list(_pending_writes)
+    _pending_writes.clear()
+    for future in futures:
+        try:
+            future.result()
+        except Exception as ex:
+            print('Background write failed - %s' % ex)
@@ -0,0 +1,209 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import random
+import time
+import aiohttp
+import instrumentation
+from exceptions import DeadlineException
+
+
+# lower is sooner: the fights, summaries and deaths every document needs, report wide event streams, then the per
+# character detail requests
+PRIORITY_REPORT = 0
+PRIORITY_EVENTS = 1
+PRIORITY_CHARACTER = 2
+
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20
+
+
+def _retry_after(response):
+    # only the delay in seconds form, WCL does not send dates
+    try:
+        return max(0.0, float(response.headers.get('Retry-After', '')))
+    except ValueError:
+        return None
+
+
+class RequestScheduler:
+    # token bucket that starts at rate requests per second, halves the rate whenever the server throttles and slowly
+    # recovers while requests succeed. Waiting requests are started in priority order, at most max_in_flight at a time
+    def __init__(self, session, rate=25, max_in_flight=10, max_retries=5, min_rate=1, deadline=None,
+                 low_priority_reserve=0):
+        self._session = session
+        # time.monotonic() by which every request has to be done. Requests below PRIORITY_REPORT are not started
+        # within low_priority_reserve seconds of it, what is left is kept for the report wide requests
+        self.deadline = deadline
+        self.low_priority_reserve = low_priority_reserve
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._in_flight = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+        self.stats = {
+            'requests': 0,
+            'retries': 0,
+            'throttled': 0,
+            'deadline': 0,
+        }
+
+    def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+
+    @contextlib.asynccontextmanager
+    async def get(self, url, priority=PRIORITY_CHARACTER):
+        # the response of the first attempt that is not throttled or a server error, or of the last attempt
+        attempt = 0
+        while True:
+            self._check_deadline(url, priority)
+            with instrumentation.timer('limiter_wait'):
+                await self._acquire(priority)
+            try:
+                self._check_deadline(url, priority)
+            except DeadlineException:
+                self._release()
+                raise
+            self.stats['requests'] += 1
+            started = time.perf_counter()
+            try:
+                if self.deadline is None:
+                    response = await self._session.get(url)
+                else:
+                    # includes reading the body, which happens before the response is released
+                    response = await self._session.get(url, timeout=aiohttp.ClientTimeout(
+                        total=max(0.1, self.deadline - time.monotonic())))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as ex:
+                instrumentation.record_request(url, None, (time.perf_counter() - started) * 1000)
+                self._release()
+                if attempt >= self.max_retries:
+                    raise
+                print('%s failed - %s' % (url, ex))
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                self.stats['retries'] += 1
+                continue
+
+            instrumentation.record_request(url, response.status, (time.perf_counter() - started) * 1000)
+            try:
+                self._observe(response)
+                if response.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    yield response
+                    return
+            finally:
+                response.release()
+                self._release()
+
+            print('%s (%d), retrying' % (response.url.human_repr(), response.status))
+            if response.status != 429:
+                await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+            self.stats['retries'] += 1
+
+    def _check_deadline(self, url, priority):
+        if self.deadline is None:
+            return
+
+        reserve = self.low_priority_reserve if priority > PRIORITY_REPORT else 0
+        if time.monotonic() + reserve >= self.deadline:
+            self.stats['deadline'] += 1
+            raise DeadlineException('Out of time for %s' % url.split('?')[0])
+
+    @staticmethod
+    def _backoff(attempt):
+        # full jitter, so requests that failed together do not retry together
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def _observe(self, response):
+        now = time.monotonic()
+        if response.status == 429:
+            self.stats['throttled'] += 1
+            if now >= self._paused_until:
+                # requests that were in flight together are throttled together, that is a single slow down
+                self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+            retry_after = _retry_after(response)
+            if retry_after is None:
+                retry_after = self._backoff(self.stats['throttled'])
+            # every request waits, not only the throttled one
+            self._paused_until = max(self._paused_until, now + retry_after + random.uniform(0, BACKOFF_BASE))
+            return
+
+        if response.status < 400:
+            self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        if remaining is not None and reset is not None:
+            try:
+                remaining = int(remaining)
+                reset = float(reset)
+            except ValueError:
+                return
+
+            # either seconds until the window resets or when it resets
+            if reset > 1000000000:
+                reset -= time.time()
+            if reset > 0:
+                self.rate = max(self.min_rate, min(self.rate, remaining / reset))
+
+    async def _acquire(self, priority):
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        self._wakeup.set()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # cancelled after it was started
+                self._release()
+            raise
+
+    def _release(self):
+        self._in_flight -= 1
+        self._wakeup.set()
+
+    def _delay(self):
+        # seconds until the next request may start
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._paused_until > now:
+            self._tokens = 0
+            return self._paused_until - now
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        return 0
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            while len(self._waiters) > 0 and self._waiters[0][2].done():
+                # cancelled while waiting
+                heapq.heappop(self._waiters)
+
+            if len(self._waiters) == 0 or self._in_flight >= self.max_in_flight:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            self._tokens -= 1
+            self._in_flight += 1
+            heapq.heappop(self._waiters)[2].set_result(None)
@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    # least recently used cache of stored documents, bounded by the total size of the values in bytes
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self._stats['misses'] += 1
+                return None
+
+            (value, expires, size) = self._entries[key]
+            if expires < time.monotonic():
+                self._remove(key)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def put(self, key, value, size=None):
+        # size defaults to the length of the value, values that are not documents pass their own
+        size = len(value) if size is None else size
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, time.monotonic() + self.ttl, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def invalidate(self, matches):
+        with self._lock:
+            for key in [x for x in self._entries.keys() if matches(x)]:
+                self._remove(key)
+
+    def _remove(self, key):
+        (value, expires, size) = self._entries.pop(key)
+        self._size -= size
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._size)
@@ -0,0 +1,40 @@
+import asyncio
+
+
+async def run_supervised(jobs, tolerated=(), max_failures=0, stopped=()):
+    # jobs are (job id, coroutine). The first failure that is not one of the tolerated exceptions, or the failure after
+    # max_failures tolerated ones, cancels every other job and is raised once they stopped, so they do not keep using
+    # up the request budget. Returns the tolerated failures and the jobs that ended with one of the stopped exceptions
+    # (which do not count as failures) as (job id, exception)
+    tasks = {asyncio.ensure_future(coroutine): job_id for (job_id, coroutine) in jobs}
+    pending = set(tasks.keys())
+    failures = []
+    failure_count = 0
+    fatal = None
+    try:
+        while len(pending) > 0 and fatal is None:
+            (done, pending) = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                # every exception is retrieved, also the ones after the fatal one
+                exception = asyncio.CancelledError() if task.cancelled() else task.exception()
+                if exception is None or fatal is not None:
+                    continue
+
+                if isinstance(exception, stopped):
+                    failures.append((tasks[task], exception))
+                elif isinstance(exception, tolerated) and failure_count < max_failures:
+                    failures.append((tasks[task], exception))
+                    failure_count += 1
+                else:
+                    fatal = exception
+    finally:
+        # also when the caller is cancelled
+        for task in pending:
+            task.cancel()
+        if len(pending) > 0:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    if fatal is not None:
+        raise fatal
+
+    return failures
@@ -0,0 +1,77 @@
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import threading
+
+os.environ.setdefault('WCL_KEY', 'test')
+os.environ.setdefault('S3_BUCKET', 'test')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+os.environ.setdefault('VERBOSE_LOGGING', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import lambda_function
+import report_store
+import wcl_parser
+from benchmarks.fake_wcl import generate_report, create_app, start_server
+
+
+FAKE_WCL_PORT = 8775
+
+
+@pytest.fixture
+def s3():
+    # an empty bucket, and nothing of a previous test left in the clients and caches of the container
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='ap-southeast-2')
+        s3_client.create_bucket(Bucket=lambda_function.S3_BUCKET,
+                                CreateBucketConfiguration={'LocationConstraint': 'ap-southeast-2'})
+        lambda_function._s3_client = None
+        lambda_function._report_lock = None
+        lambda_function._report_queue = None
+        report_store._response_cache.invalidate(lambda x: True)
+        yield s3_client
+
+
+@contextlib.contextmanager
+def serve(app, port):
+    # on a loop of its own, the parsers run theirs. Yields the base domain
+    loop = asyncio.new_event_loop()
+    (runner, base_domain) = loop.run_until_complete(start_server(app, port))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    try:
+        yield base_domain
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+@pytest.fixture(scope='session')
+def wcl():
+    # fake_wcl answers for any report id, app['requests'] counts the requests per endpoint. Small pages, so the events
+    # streams take a few requests each
+    app = create_app(generate_report(characters=6, fights=8, events_per_fight=10), page_size=40)
+    with serve(app, FAKE_WCL_PORT) as base_domain:
+        wcl_parser.WCLParser.BASE_DOMAIN = base_domain
+        yield app
+
+
+def request(report_id, fight_id=-1, **event):
+    event['pathParameters'] = {'id': report_id, 'fight': str(fight_id)}
+    return lambda_function.lambda_handler(event, {})
+
+
+def wcl_requests(app):
+    return sum(app['requests'].values())
+
+
+def documents(parser):
+    # every document a full parse stores, comparable between parses
+    fight_ids = [x['id'] for x in parser.fights.values() if x['boss'] > 0] + [-1, 0]
+    return json.dumps({fight_id: parser.to_json(fight_id) for fight_id in fight_ids}, sort_keys=True)
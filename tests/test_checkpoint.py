@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import pytest
+
+import wcl_parser
+from exceptions import DeadlineException
+from request_scheduler import RequestScheduler
+from conftest import documents
+
+REPORT_ID = 'R' * 16
+
+
+def parse(fetch_mode, checkpoint=None):
+    async def run():
+        async with wcl_parser.WCLParser(REPORT_ID, fetch_mode, metrics=list(wcl_parser.FETCH_PLAN)) as parser:
+            return await parser.parse_report(checkpoint)
+
+    return asyncio.run(run())
+
+
+def limit_requests(monkeypatch, requests):
+    # every parser runs out of time once it sent this many requests
+    def check_deadline(self, url, priority):
+        if self.stats['requests'] >= requests:
+            raise DeadlineException('Out of time for %s' % url.split('?')[0])
+
+    monkeypatch.setattr(RequestScheduler, '_check_deadline', check_deadline)
+
+
+@pytest.mark.parametrize('fetch_mode', [wcl_parser.FETCH_MODE_CHARACTER, wcl_parser.FETCH_MODE_REPORT])
+def test_resumed_parse_matches_a_full_one(wcl, monkeypatch, fetch_mode):
+    expected = documents(parse(fetch_mode))
+
+    limit_requests(monkeypatch, 4)
+    parser = parse(fetch_mode)
+    rounds = 1
+    while parser.checkpoint is not None:
+        assert parser.checkpoint['rounds'] == rounds
+        # stored as json between invocations
+        parser = parse(fetch_mode, json.loads(json.dumps(parser.checkpoint)))
+        rounds += 1
+        assert rounds < 100
+
+    assert rounds > 2
+    assert documents(parser) == expected
+
+
+def test_checkpoint_of_another_fetch_mode_is_ignored(wcl, monkeypatch):
+    expected = documents(parse(wcl_parser.FETCH_MODE_CHARACTER))
+
+    with monkeypatch.context() as patch:
+        limit_requests(patch, 6)
+        checkpoint = json.loads(json.dumps(parse(wcl_parser.FETCH_MODE_REPORT).checkpoint))
+    assert len(checkpoint['done']) > 0
+
+    parser = parse(wcl_parser.FETCH_MODE_CHARACTER, checkpoint)
+    assert parser.checkpoint is None
+    assert documents(parser) == expected
@@ -0,0 +1,13 @@
+import json
+
+from conftest import request
+
+
+def test_one_metrics_line_per_invocation(s3, wcl, capsys):
+    capsys.readouterr()
+    assert request('M' * 16)['statusCode'] == 200
+    lines = [json.loads(x) for x in capsys.readouterr().out.splitlines() if x.startswith('{"_aws"')]
+    assert len(lines) == 1
+    for name in ['scheduler', 'item_cache', 'connections', 'response_cache', 'endpoints']:
+        assert name in lines[0]
+    assert lines[0]['scheduler']['requests'] == lines[0]['requests']
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+import intervals
+
+FIGHTS = [{'id': 1, 'start_time': 1000, 'end_time': 2000}, {'id': 2, 'start_time': 3000, 'end_time': 5000}]
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def fight_windows(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(intervals, 'numpy', None)
+    elif intervals.numpy is None:
+        pytest.skip('numpy is not installed')
+    return intervals.FightWindows
+
+
+def overlaps(fight_windows, bands, fights=FIGHTS):
+    return [(fight['id'], buff_length, prebuff)
+            for (fight, buff_length, prebuff) in fight_windows(fights).band_overlaps(bands)]
+
+
+def band(start_time, end_time):
+    return {'startTime': start_time, 'endTime': end_time}
+
+
+def test_band_past_the_fight_end(fight_windows):
+    # clipped to each fight it overlaps
+    assert overlaps(fight_windows, [band(1500, 4000)]) == [(1, 500, False), (2, 1000, False)]
+    assert overlaps(fight_windows, [band(0, 10000)]) == [(1, 1000, False), (2, 2000, False)]
+
+
+def test_overlapping_bands(fight_windows):
+    # up at most the whole fight
+    assert overlaps(fight_windows, [band(1200, 2500), band(1000, 1800), band(1100, 1300)]) == [(1, 1000, True)]
+    assert overlaps(fight_windows, [band(3500, 3600), band(3500, 3600)]) == [(2, 100, False)]
+
+
+def test_prebuff(fight_windows):
+    assert overlaps(fight_windows, [band(1000, 1100)]) == [(1, 100, True)]
+    # already up before the pull, or a band ending as another starts with the fight
+    assert overlaps(fight_windows, [band(900, 1100)]) == [(1, 100, False)]
+    assert overlaps(fight_windows, [band(500, 1000), band(1000, 1100)]) == [(1, 100, True)]
+    assert overlaps(fight_windows, [band(1001, 1100), band(3000, 3000)]) == [(1, 99, False)]
+
+
+def test_numpy_and_python_agree(monkeypatch):
+    if intervals.numpy is None:
+        pytest.skip('numpy is not installed')
+
+    rnd = random.Random(1)
+    fights = []
+    time = 0
+    for fight_id in range(1, 40):
+        length = rnd.randint(1000, 30000)
+        fights.append({'id': fight_id, 'start_time': time, 'end_time': time + length})
+        time += length + rnd.choice([0, rnd.randint(1, 5000)])
+
+    for _ in range(20):
+        bands = []
+        for _ in range(rnd.randint(0, 200)):
+            start_time = rnd.choice([rnd.choice(fights)['start_time'], rnd.randint(0, time)])
+            bands.append(band(start_time, start_time + rnd.randint(0, 20000)))
+
+        expected = overlaps(intervals.FightWindows, bands, fights)
+        with monkeypatch.context() as patch:
+            patch.setattr(intervals, 'numpy', None)
+            assert overlaps(intervals.FightWindows, bands, fights) == expected
+        fight_lengths = {x['id']: x['end_time'] - x['start_time'] for x in fights}
+        assert all(buff_length <= fight_lengths[fight_id] for (fight_id, buff_length, _) in expected)
@@ -0,0 +1,62 @@
+import json
+import threading
+
+import pytest
+
+import lambda_function
+import report_lock
+import report_queue
+import report_store
+from conftest import request, wcl_requests
+
+REPORT_ID = 'F' * 16
+VERSION = lambda_function.API_VERSION
+# a boss fight of the fake report
+FIGHT_ID = 4
+
+
+@pytest.fixture
+def lazy(s3, wcl, monkeypatch):
+    monkeypatch.setattr(lambda_function, 'LAZY_FIGHT_PARSE', 'defer')
+    monkeypatch.setattr(lambda_function, 'REPORT_LOCK_POLL', 0.1)
+    return s3
+
+
+def stored_keys(s3):
+    return sorted(x['Key'] for x in s3.list_objects_v2(Bucket=lambda_function.S3_BUCKET).get('Contents', []))
+
+
+def test_only_the_fight_is_parsed(lazy):
+    response = request(REPORT_ID, FIGHT_ID)
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['reportId'] == REPORT_ID
+    assert report_store.fight_key(REPORT_ID, VERSION, FIGHT_ID) in stored_keys(lazy)
+    assert report_store.fight_key(REPORT_ID, VERSION, -1) not in stored_keys(lazy)
+    assert not lambda_function.get_report_lock().is_locked(REPORT_ID, VERSION)
+
+
+def test_waits_for_the_parse_of_another_invocation(lazy, wcl):
+    other = report_lock.S3ReportLock(lazy, lambda_function.S3_BUCKET)
+    assert other.acquire(REPORT_ID, VERSION)
+
+    def store():
+        report_store.save_fights(lazy, lambda_function.S3_BUCKET, REPORT_ID, VERSION,
+                                 {FIGHT_ID: {'reportId': REPORT_ID, 'other': True}})
+        other.release(REPORT_ID, VERSION)
+
+    timer = threading.Timer(0.3, store)
+    timer.start()
+    requests = wcl_requests(wcl)
+    response = request(REPORT_ID, FIGHT_ID)
+    timer.join()
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['other']
+    assert wcl_requests(wcl) == requests
+
+
+def test_queued_with_a_queue(lazy, wcl):
+    lambda_function._report_queue = report_queue.LocalReportQueue()
+    requests = wcl_requests(wcl)
+    assert request(REPORT_ID, FIGHT_ID)['statusCode'] == 202
+    assert len(lambda_function._report_queue) == 1
+    assert wcl_requests(wcl) == requests
@@ -0,0 +1,22 @@
+import os
+import subprocess
+import sys
+
+
+def import_parser(metrics):
+    # in a process of its own, the metrics are read when the module is loaded
+    return subprocess.run([sys.executable, '-c', 'import wcl_parser; print(wcl_parser.METRICS)'],
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), capture_output=True,
+                          text=True, env=dict(os.environ, WCL_METRICS=metrics))
+
+
+def test_unknown_metric_fails_on_load():
+    result = import_parser('casts,buff')
+    assert result.returncode != 0
+    assert 'Unknown WCL_METRICS buff' in result.stderr
+
+
+def test_metrics():
+    result = import_parser('casts, damage-taken')
+    assert result.returncode == 0
+    assert result.stdout.strip() == "['casts', 'damage-taken']"
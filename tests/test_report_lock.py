@@ -0,0 +1,68 @@
+import time
+
+import lambda_function
+import report_lock
+
+REPORT_ID = 'L' * 16
+VERSION = lambda_function.API_VERSION
+
+
+class Context:
+    def __init__(self, milliseconds):
+        self.deadline = time.monotonic() + milliseconds / 1000
+
+    def get_remaining_time_in_millis(self):
+        return (self.deadline - time.monotonic()) * 1000
+
+
+def create_lock(s3, ttl=report_lock.REPORT_LOCK_TTL):
+    # one per container
+    return report_lock.S3ReportLock(s3, lambda_function.S3_BUCKET, ttl)
+
+
+def test_single_holder(s3):
+    (first, second) = (create_lock(s3), create_lock(s3))
+    assert first.acquire(REPORT_ID, VERSION)
+    assert not second.acquire(REPORT_ID, VERSION)
+    assert second.is_locked(REPORT_ID, VERSION)
+
+    first.release(REPORT_ID, VERSION)
+    assert not second.is_locked(REPORT_ID, VERSION)
+    assert second.acquire(REPORT_ID, VERSION)
+
+
+def test_release_keeps_a_lease_taken_over(s3):
+    # the first parse ran past the ttl, its release must not end the lease of the second
+    (first, second, third) = (create_lock(s3, ttl=-1), create_lock(s3), create_lock(s3))
+    assert first.acquire(REPORT_ID, VERSION)
+    assert second.acquire(REPORT_ID, VERSION)
+    first.release(REPORT_ID, VERSION)
+    assert third.is_locked(REPORT_ID, VERSION)
+    assert not third.acquire(REPORT_ID, VERSION)
+
+
+def test_one_takeover_of_an_expired_lease(s3):
+    (expired, second, third) = (create_lock(s3, ttl=-1), create_lock(s3), create_lock(s3))
+    assert expired.acquire(REPORT_ID, VERSION)
+
+    # the third takes the lease over between the second reading it and writing its own
+    get_lease = second._get_lease
+
+    def interleaved(report_id, version):
+        lease = get_lease(report_id, version)
+        assert third.acquire(report_id, version)
+        return lease
+
+    second._get_lease = interleaved
+    assert not second.acquire(REPORT_ID, VERSION)
+    second.release(REPORT_ID, VERSION)
+    assert third.is_locked(REPORT_ID, VERSION)
+
+
+def test_wait_ends_before_the_invocation(s3, monkeypatch):
+    monkeypatch.setattr(lambda_function, 'DEADLINE_MARGIN', 0.5)
+    create_lock(s3).acquire(REPORT_ID, VERSION)
+    started = time.monotonic()
+    event = {'pathParameters': {'id': REPORT_ID, 'fight': '-1'}}
+    assert lambda_function.lambda_handler(event, Context(1500))['statusCode'] == 503
+    assert time.monotonic() - started < 2
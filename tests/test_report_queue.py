@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+import lambda_function
+import report_queue
+import report_store
+from exceptions import RequestException
+from conftest import request, wcl_requests
+
+REPORT_ID = 'Q' * 16
+
+
+@pytest.fixture
+def queue(s3, wcl):
+    lambda_function._report_queue = report_queue.LocalReportQueue()
+    yield lambda_function._report_queue
+    lambda_function._report_queue = None
+
+
+def get(path):
+    # a request for a path of the api, as the client polls it
+    (path, _, query) = path.partition('?')
+    (_, _, report_id, fight_id) = path.split('/')
+    parameters = dict(x.split('=') for x in query.split('&')) if query != '' else {}
+    return request(report_id, int(fight_id), path=path, queryStringParameters=parameters)
+
+
+def drain(queue):
+    while len(queue) > 0:
+        assert lambda_function.queue_handler({'Records': queue.receive()}, {}) == {'batchItemFailures': []}
+
+
+def test_miss_is_queued(queue):
+    path = '/report/%s/-1' % REPORT_ID
+    response = get(path)
+    assert response['statusCode'] == 202
+    assert response['headers']['Location'] == path
+    # polling does not queue the report again
+    assert get(path)['statusCode'] == 202
+    assert len(queue) == 1
+
+    drain(queue)
+    response = get(path)
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['reportId'] == REPORT_ID
+    assert get('/report/%s/999' % REPORT_ID)['statusCode'] == 404
+    assert len(queue) == 0
+
+
+def test_refresh_is_polled_until_done(queue, wcl):
+    path = '/report/%s/-1' % REPORT_ID
+    get(path)
+    drain(queue)
+    stored = get(path)['body']
+
+    response = get(path + '?refresh=1')
+    assert response['statusCode'] == 202
+    location = response['headers']['Location']
+    assert location.startswith(path + '?refresh=') and location != path + '?refresh=1'
+    # a refresh requested meanwhile joins the queued one, its location does not serve the fight from before it
+    assert get(path + '?refresh=1')['headers']['Location'] == location
+    assert get(location)['statusCode'] == 202
+    assert len(queue) == 1
+
+    requests = wcl_requests(wcl)
+    drain(queue)
+    assert wcl_requests(wcl) > requests
+
+    for _ in range(2):
+        response = get(location)
+        assert response['statusCode'] == 200
+        assert response['body'] == stored
+    assert len(queue) == 0
+
+
+def test_failure_is_returned_once(queue, monkeypatch):
+    async def fail(*arguments):
+        raise RequestException('Unexpected response 401')
+
+    monkeypatch.setattr(lambda_function, 'async_handler', fail)
+    path = '/report/%s/-1' % REPORT_ID
+    assert get(path)['statusCode'] == 202
+    drain(queue)
+    assert get(path)['statusCode'] == 502
+    # and queued again by the next request
+    assert get(path)['statusCode'] == 202
+    assert len(queue) == 1
+
+
+def test_scheduled_parse_is_queued_once(queue, s3):
+    for _ in range(3):
+        lambda_function.schedule_report_parse(REPORT_ID, {})
+    assert len(queue) == 1
+    status = report_store.load_status(s3, lambda_function.S3_BUCKET, REPORT_ID, lambda_function.API_VERSION)
+    assert status['status'] == 'queued'
+    assert get('/report/%s/-1' % REPORT_ID)['statusCode'] == 202
+    assert len(queue) == 1
@@ -0,0 +1,89 @@
+import gzip
+import json
+
+import pytest
+
+import lambda_function
+import report_store
+from conftest import request, wcl_requests
+
+REPORT_ID = 'P' * 16
+VERSION = lambda_function.API_VERSION
+
+
+def fights(size, title='x'):
+    # documents of different lengths, the summary large enough to reach past small prefetches
+    return {fight_id: {'id': fight_id, 'title': title * (size * (i + 1))}
+            for i, fight_id in enumerate([-1, 0, 4, 7])}
+
+
+def load(s3, fight_id, encodings=()):
+    (file_content, encoding) = report_store.load_fight(s3, lambda_function.S3_BUCKET, REPORT_ID, VERSION, fight_id,
+                                                       report_store.STORAGE_FORMAT_PACKED, encodings)
+    if file_content is None:
+        return None
+    assert encoding in encodings + (report_store.ENCODING_IDENTITY,)
+    return json.loads(gzip.decompress(file_content) if encoding == 'gzip' else file_content)
+
+
+@pytest.mark.parametrize('prefetch_bytes', [16, 100, 1000, 65536])
+def test_packed_fights_round_trip(s3, monkeypatch, prefetch_bytes):
+    monkeypatch.setattr(report_store, 'PACK_PREFETCH_BYTES', prefetch_bytes)
+    monkeypatch.setattr(report_store, 'PRECOMPRESSED_ENCODINGS', ['gzip'])
+    stored = fights(50)
+    report_store.save_fights(s3, lambda_function.S3_BUCKET, REPORT_ID, VERSION, stored,
+                             storage_format=report_store.STORAGE_FORMAT_PACKED)
+
+    for encodings in [(), ('gzip',)]:
+        for fight_id, document in stored.items():
+            # read back from S3, not from the documents cached by the write
+            report_store.invalidate_report(REPORT_ID, VERSION)
+            assert load(s3, fight_id, encodings) == document
+        # with the index cached
+        assert [load(s3, x, encodings) for x in stored] == list(stored.values())
+
+
+def test_precompression_is_opt_in(s3, monkeypatch):
+    monkeypatch.setattr(report_store, 'PRECOMPRESSED_ENCODINGS', [])
+    report_store.save_fights(s3, lambda_function.S3_BUCKET, REPORT_ID, VERSION, fights(5))
+    keys = [x['Key'] for x in s3.list_objects_v2(Bucket=lambda_function.S3_BUCKET)['Contents']]
+    assert sorted(keys) == sorted(report_store.fight_key(REPORT_ID, VERSION, x) for x in fights(5))
+
+
+def test_packed_missing_fight(s3):
+    assert load(s3, -1) is None
+    report_store.save_fights(s3, lambda_function.S3_BUCKET, REPORT_ID, VERSION, fights(5),
+                             storage_format=report_store.STORAGE_FORMAT_PACKED)
+    report_store.invalidate_report(REPORT_ID, VERSION)
+    assert load(s3, 999) is None
+
+
+def test_packed_report_rewritten_elsewhere(s3):
+    report_store.save_fights(s3, lambda_function.S3_BUCKET, REPORT_ID, VERSION, fights(20),
+                             storage_format=report_store.STORAGE_FORMAT_PACKED)
+    report_store.invalidate_report(REPORT_ID, VERSION)
+    load(s3, -1)
+
+    # stored again by another container: its index is still cached here, the documents it read are not
+    rewritten = fights(30, 'y')
+    rewritten[8] = {'id': 8, 'title': 'new'}
+    s3.put_object(Bucket=lambda_function.S3_BUCKET, Key=report_store.packed_key(REPORT_ID, VERSION),
+                  Body=report_store.pack_fights({x: report_store.encode_fight(y) for x, y in rewritten.items()}))
+    report_store._response_cache.invalidate(lambda x: x[2] != report_store.PACKED_INDEX)
+
+    assert load(s3, 4) == rewritten[4]
+    assert load(s3, 8) == rewritten[8]
+
+
+def test_packed_misses_are_parsed(s3, wcl, monkeypatch):
+    monkeypatch.setattr(lambda_function, 'STORAGE_FORMAT', report_store.STORAGE_FORMAT_PACKED)
+    requests = wcl_requests(wcl)
+    response = request(REPORT_ID)
+    assert response['statusCode'] == 200
+    assert wcl_requests(wcl) > requests
+
+    report_store.invalidate_report(REPORT_ID, VERSION)
+    requests = wcl_requests(wcl)
+    assert request(REPORT_ID, 999)['statusCode'] == 404
+    assert wcl_requests(wcl) > requests
+    assert json.loads(request(REPORT_ID)['body']) == json.loads(response['body'])
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+
+import wcl_parser
+from benchmarks.fake_wcl import generate_report, create_app
+from conftest import serve
+from exceptions import DeadlineException, RequestException
+from request_scheduler import RequestScheduler, PRIORITY_REPORT, PRIORITY_EVENTS, PRIORITY_CHARACTER
+
+PORT = 8778
+REPORT = generate_report(characters=2, fights=4, events_per_fight=2)
+URL = '/v1/report/fights/%s' % ('S' * 16)
+
+
+def schedule(requests, faults=None, **scheduler):
+    # runs requests(scheduler) against a fake server with the faults of fake_wcl.create_app, returns its result and
+    # the scheduler
+    async def run(base_domain):
+        async with aiohttp.ClientSession(base_domain) as session:
+            request_scheduler = RequestScheduler(session, **scheduler)
+            try:
+                return await requests(request_scheduler), request_scheduler
+            finally:
+                request_scheduler.close()
+
+    with serve(create_app(REPORT, **(faults or {})), PORT) as base_domain:
+        return asyncio.run(run(base_domain))
+
+
+async def get_status(request_scheduler, priority=PRIORITY_CHARACTER):
+    async with request_scheduler.get(URL, priority) as response:
+        return response.status
+
+
+def test_throttling_halves_the_rate_once_and_pauses():
+    async def requests(request_scheduler):
+        started = time.monotonic()
+        statuses = await asyncio.gather(*[get_status(request_scheduler) for _ in range(4)])
+        return statuses, time.monotonic() - started
+
+    # the server takes two requests, the other two are throttled together with Retry-After: 1
+    ((statuses, elapsed), request_scheduler) = schedule(requests, {'rate_limit': 2}, rate=10)
+    assert statuses == [200] * 4
+    assert request_scheduler.stats['throttled'] == 2
+    # halved, then recovering a little with every success
+    assert 5 < request_scheduler.rate < 6
+    assert elapsed >= 1
+
+
+def test_requests_start_in_priority_order():
+    started = []
+
+    async def get(request_scheduler, priority):
+        async with request_scheduler.get(URL, priority):
+            started.append(priority)
+
+    async def requests(request_scheduler):
+        priorities = [PRIORITY_CHARACTER, PRIORITY_EVENTS, PRIORITY_REPORT, PRIORITY_CHARACTER, PRIORITY_REPORT]
+        await asyncio.gather(*[get(request_scheduler, x) for x in priorities])
+
+    schedule(requests, max_in_flight=1)
+    assert started == [PRIORITY_REPORT, PRIORITY_REPORT, PRIORITY_EVENTS, PRIORITY_CHARACTER, PRIORITY_CHARACTER]
+
+
+def test_in_flight_cap():
+    in_flight = []
+
+    async def get(request_scheduler):
+        async with request_scheduler.get(URL):
+            in_flight.append(request_scheduler._in_flight)
+
+    async def requests(request_scheduler):
+        started = time.monotonic()
+        await asyncio.gather(*[get(request_scheduler) for _ in range(6)])
+        return time.monotonic() - started
+
+    (elapsed, _) = schedule(requests, {'latency': 0.1}, rate=100, max_in_flight=2)
+    assert max(in_flight) == 2
+    # three rounds of two
+    assert elapsed >= 0.3
+
+
+def test_deadline():
+    async def requests(request_scheduler):
+        # within the reserve only the report wide requests start
+        with pytest.raises(DeadlineException):
+            await get_status(request_scheduler, PRIORITY_CHARACTER)
+        assert await get_status(request_scheduler, PRIORITY_REPORT) == 200
+
+        request_scheduler.deadline = time.monotonic()
+        with pytest.raises(DeadlineException):
+            await get_status(request_scheduler, PRIORITY_REPORT)
+
+    (_, request_scheduler) = schedule(requests, deadline=time.monotonic() + 5, low_priority_reserve=10)
+    assert request_scheduler.stats['deadline'] == 2
+    assert request_scheduler.stats['requests'] == 1
+
+
+def test_response_that_is_not_json():
+    async def requests(request_scheduler):
+        async with wcl_parser.WCLParser('S' * 16, session=request_scheduler._session) as parser:
+            with pytest.raises(RequestException):
+                await parser._get_json('/v1/report/tables/unknown/%s' % ('S' * 16), PRIORITY_REPORT)
+
+    schedule(requests)
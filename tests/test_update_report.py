@@ -0,0 +1,58 @@
+import asyncio
+import copy
+import json
+
+import pytest
+
+import wcl_parser
+from benchmarks.fake_wcl import generate_report, create_app
+from conftest import serve, documents
+
+REPORT_ID = 'U' * 16
+
+
+def uploaded_until(report, fight_id):
+    # the report as it was while it was still being uploaded, up to the end of a fight
+    end_time = next(x['end_time'] for x in report['fights'] if x['id'] == fight_id)
+    part = copy.deepcopy(report)
+    part['end'] = report['start'] + end_time
+    part['fights'] = [x for x in report['fights'] if x['id'] <= fight_id]
+    part['events'] = {event_type: [x for x in events if x['timestamp'] <= end_time]
+                      for event_type, events in report['events'].items()}
+    part['auras'] = {player_id: [dict(aura, bands=[dict(x, endTime=min(x['endTime'], end_time))
+                                                   for x in aura['bands'] if x['startTime'] <= end_time])
+                                 for aura in auras]
+                     for player_id, auras in report['auras'].items()}
+    part['deaths'] = [x for x in report['deaths'] if x['fight'] <= fight_id]
+    part['summaries'] = {x: y for x, y in report['summaries'].items() if x <= fight_id}
+    for friendly in part['friendlies']:
+        friendly['fights'] = [x for x in friendly['fights'] if x['id'] <= fight_id]
+    return part
+
+
+def run(fetch_mode, parse):
+    async def run_parser():
+        async with wcl_parser.WCLParser(REPORT_ID, fetch_mode, metrics=list(wcl_parser.FETCH_PLAN)) as parser:
+            return await parse(parser)
+
+    return asyncio.run(run_parser())
+
+
+@pytest.mark.parametrize('fetch_mode', [wcl_parser.FETCH_MODE_CHARACTER, wcl_parser.FETCH_MODE_REPORT])
+def test_update_matches_a_full_parse(monkeypatch, fetch_mode):
+    report = generate_report(characters=6, fights=12, events_per_fight=10)
+    with serve(create_app(uploaded_until(report, 8), page_size=40), 8779) as base_domain:
+        monkeypatch.setattr(wcl_parser.WCLParser, 'BASE_DOMAIN', base_domain)
+        # stored as json with the fights
+        state = json.loads(json.dumps(run(fetch_mode, lambda x: x.parse_report()).get_state()))
+
+    app = create_app(report, page_size=40)
+    with serve(app, 8780) as base_domain:
+        monkeypatch.setattr(wcl_parser.WCLParser, 'BASE_DOMAIN', base_domain)
+        updated = run(fetch_mode, lambda x: x.update_report(state))
+        requests = sum(app['requests'].values())
+        assert updated is not None
+        assert documents(updated) == documents(run(fetch_mode, lambda x: x.parse_report()))
+        # the update only read what was added
+        assert requests < sum(app['requests'].values()) - requests
+        assert run(fetch_mode, lambda x: x.update_report(json.loads(json.dumps(updated.get_state())))) is None
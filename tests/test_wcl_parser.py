@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+import wcl_parser
+from benchmarks.fake_wcl import generate_report, create_app
+from conftest import serve, documents
+from exceptions import RequestException
+
+REPORT_ID = 'W' * 16
+
+
+def parse(fetch_mode=wcl_parser.FETCH_MODE_REPORT):
+    async def run():
+        async with wcl_parser.WCLParser(REPORT_ID, fetch_mode, metrics=list(wcl_parser.FETCH_PLAN)) as parser:
+            return await parser.parse_report()
+
+    return asyncio.run(run())
+
+
+def test_pages_of_events_sharing_a_timestamp(monkeypatch):
+    report = generate_report(characters=3, fights=4, events_per_fight=10)
+    for event_list in report['events'].values():
+        # runs of 20 events at the same time, longer than a page
+        for i, event in enumerate(event_list):
+            event['timestamp'] = event_list[i - i % 20]['timestamp']
+
+    parsed = []
+    for (port, page_size) in [(8776, 10000), (8777, 7)]:
+        app = create_app(report, page_size=page_size)
+        with serve(app, port) as base_domain:
+            monkeypatch.setattr(wcl_parser.WCLParser, 'BASE_DOMAIN', base_domain)
+            parsed.append(documents(parse()))
+        # a page per run
+        assert (app['requests']['events/casts'] > 1) == (page_size < 20)
+
+    assert parsed[0] == parsed[1]
+
+
+def test_page_not_moving_ahead(monkeypatch):
+    requests = []
+
+    async def get_json(url, priority, decode=None):
+        requests.append(url)
+        return {'events': [{'timestamp': 100}], 'nextPageTimestamp': 100}
+
+    async def run():
+        async with wcl_parser.WCLParser(REPORT_ID) as parser:
+            monkeypatch.setattr(parser, '_get_json', get_json)
+            async for _ in parser._iter_events('casts', 100, 1000):
+                pass
+
+    with pytest.raises(RequestException):
+        asyncio.run(run())
+    assert len(requests) == 1
@@ -3,13 +3,49 @@ import asyncio
 from constants import RESIST_RANDOM_ENCHANT_BY_SLOT, UNENCHANTABLE_SLOTS, SLOT_MAIN_HAND, SLOT_OFF_HAND, \
     RESISTANCE_GEMS, RESISTANCE_ENCHANTS, SLOT_SHIRT, SLOT_TABARD, RESISTANCE_BUFFS
 import decimal
-import json
-from glob import glob
-from exceptions import NotFoundException
-from aiolimiter import AsyncLimiter
+from exceptions import NotFoundException, RequestException, DeadlineException
+from accumulators import FightAccumulator
+from intervals import FightWindows
+import item_index
+import json_codec
+import event_schema
+import instrumentation
+from task_group import run_supervised
+from request_scheduler import RequestScheduler, PRIORITY_REPORT, PRIORITY_EVENTS, PRIORITY_CHARACTER
 import os
 
 
+# per character: a request per character and metric, filtered by sourceid
+# report: a request per metric, events are demultiplexed by character locally
+FETCH_MODE_CHARACTER = 'character'
+FETCH_MODE_REPORT = 'report'
+FETCH_MODE_AUTO = 'auto'
+
+# metric -> (per character fetch, whole report fetch). load_subsequent_data only fetches the enabled metrics, metrics
+# without a per character fetch are fetched once for the report in both fetch modes
+FETCH_PLAN = {
+    'casts': ('get_character_casts', 'get_report_casts'),
+    'buffs': ('get_character_buffs', 'get_report_buffs'),
+    'healing': ('get_character_healing', 'get_report_healing'),
+    'damage-taken': ('get_character_damage_taken', 'get_report_damage_taken'),
+    'deaths': (None, 'get_deaths'),
+    'interrupts': (None, 'get_interrupts'),
+}
+# damage taken is one of the largest event streams, it is only fetched when listed in WCL_METRICS
+METRICS = [x.strip() for x in os.environ.get('WCL_METRICS', 'casts,buffs,healing,deaths,interrupts').split(',')
+           if x.strip() != '']
+if any(x not in FETCH_PLAN for x in METRICS):
+    # otherwise every parse fails on it in load_subsequent_data
+    raise ValueError('Unknown WCL_METRICS %s, expected some of %s'
+                     % (','.join(x for x in METRICS if x not in FETCH_PLAN), ','.join(FETCH_PLAN)))
+# partial results: requests that still fail after their retries leave their section incomplete instead of failing the
+# parse, as long as no more than this share of the requests for a report fail
+PARTIAL_RESULTS = os.environ.get('PARTIAL_RESULTS', '0').lower() in ['1', 'true']
+PARTIAL_RESULTS_MAX_FAILED = float(os.environ.get('PARTIAL_RESULTS_MAX_FAILED', '0.1'))
+# a response that could not be read completely
+READ_ERRORS = (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) + json_codec.DECODE_ERRORS
+
+
 def replace_decimals(obj):
     if isinstance(obj, list):
         for i in range(len(obj)):
@@ -48,10 +84,10 @@ def create_fight(fight):
 
 
 def create_character(character, fights):
-    per_fight = {x['id']: x for x in character['fights'] if fights[x['id']]['boss'] > 0}
-    per_fight[0] = {"id": 0}    # trash
-    per_fight[-1] = {"id": -1}  # summary
-    print("%s - %d fights" % (character['name'], len(per_fight) - 2))
+    per_fight = {x['id']: FightAccumulator(x) for x in character['fights'] if fights[x['id']]['boss'] > 0}
+    per_fight[0] = FightAccumulator({"id": 0})    # trash
+    per_fight[-1] = FightAccumulator({"id": -1})  # summary
+    instrumentation.verbose("%s - %d fights" % (character['name'], len(per_fight) - 2))
     return {
         "id": character['id'],
         "name": character['name'],
@@ -69,10 +105,20 @@ def create_pet(pet):
 
 
 class WCLParser:
-    BASE_DOMAIN = "https://classic.warcraftlogs.com"
+    # WCL_BASE_DOMAIN points the parser at a local server, see benchmarks.replay and benchmarks.fake_wcl
+    BASE_DOMAIN = os.environ.get('WCL_BASE_DOMAIN', "https://classic.warcraftlogs.com")
     API_KEY = os.environ['WCL_KEY']
-
-    def __init__(self, report_id):
+    # from this many characters on, auto mode fetches events once for the whole report
+    REPORT_FETCH_MIN_CHARACTERS = 10
+    REQUEST_RATE = int(os.environ.get('WCL_REQUEST_RATE', '25'))
+    MAX_IN_FLIGHT = int(os.environ.get('WCL_MAX_IN_FLIGHT', '10'))
+    # responses cut off or garbled on the way are requested again, throttling and server errors are retried by the
+    # scheduler
+    READ_RETRIES = 2
+    # seconds before the deadline from which only the report wide requests are started
+    LOW_PRIORITY_RESERVE = float(os.environ.get('WCL_LOW_PRIORITY_RESERVE', '3'))
+
+    def __init__(self, report_id, fetch_mode=FETCH_MODE_AUTO, session=None, metrics=None, deadline=None):
         self.endTimestamp = None
         self.startTimestamp = None
         self.endTime = None
@@ -81,13 +127,34 @@ class WCLParser:
         self.pets = None
         self.characters = None
         self.fights = None
+        self._fight_windows = None
+        # events are fetched in this window: the whole report, what was added after a previous parse or one fight
+        self._events_start_time = None
+        self._events_end_time = None
         self.report_id = report_id
-        self._session = aiohttp.ClientSession(WCLParser.BASE_DOMAIN)
-        self._bucket = AsyncLimiter(25, 1)
-        self._item_cache = {}
+        self.fetch_mode = fetch_mode
+        self.metrics = metrics if metrics is not None else METRICS
+        # section -> ids of the characters whose requests failed, None when a whole report section failed
+        self.incomplete = {}
+        # progress of a parse that ran out of time (deadline): the finished jobs of load_subsequent_data, where each
+        # events stream continues, the buff bands rebuilt so far (get_report_buffs) and how many invocations it took.
+        # checkpoint is set when the parse stopped before it was done
+        self._done_jobs = set()
+        self._streams = {}
+        self._auras = {}
+        self._rounds = 0
+        self.checkpoint = None
+        # a session shared with other parsers (wcl_session) is left open
+        self._owns_session = session is None
+        if session is None:
+            session = aiohttp.ClientSession(WCLParser.BASE_DOMAIN,
+                                            connector=aiohttp.TCPConnector(limit=WCLParser.MAX_IN_FLIGHT))
+        self._session = session
+        self._scheduler = RequestScheduler(self._session, WCLParser.REQUEST_RATE, WCLParser.MAX_IN_FLIGHT,
+                                           deadline=deadline, low_priority_reserve=WCLParser.LOW_PRIORITY_RESERVE)
 
     def to_json(self, fight_id):
-        return {
+        data = {
             "title": self.title,
             "reportId": self.report_id,
             "startTime": self.startTime,
@@ -95,13 +162,25 @@ class WCLParser:
             "startTimestamp": self.startTimestamp,
             "endTimestamp": self.endTimestamp,
             "fights": [x for x in self.fights.values()],
-            "characters": {x['id']: {'id': x['id'], 'name': x['name'], 'type': x['type'], 'data': x['per_fight'][fight_id]}
+            "characters": {x['id']: {'id': x['id'], 'name': x['name'], 'type': x['type'], 'data': x['per_fight'][fight_id].to_json()}
                            for x in self.characters.values() if fight_id in x['per_fight']},
             "pets": self.pets,
         }
+        if len(self.incomplete) > 0:
+            data['completeness'] = {x: x not in self.incomplete for x in self._sections()}
+            for section, player_ids in self.incomplete.items():
+                for player_id in player_ids if player_ids is not None else []:
+                    if player_id in data['characters']:
+                        data['characters'][player_id].setdefault('incomplete', []).append(section)
+        return data
 
     async def close(self):
-        await self._session.close()
+        # the request and item cache counters go into the metrics line of the invocation
+        instrumentation.set_property('scheduler', dict(self._scheduler.stats))
+        instrumentation.set_property('item_cache', item_index.item_cache_stats())
+        self._scheduler.close()
+        if self._owns_session:
+            await self._session.close()
 
     async def __aenter__(self):
         return self
@@ -109,58 +188,142 @@ class WCLParser:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.close()
 
-    def _preload_item_data(self):
-        for file_name in glob('./data/*/*/*.json'):
-            with open(file_name) as json_file:
-                data = json.load(json_file)
-                for item in [x for x in data if 'id' in x]:
-                    self._item_cache[item['id']] = {
-                        'id': item['id'],
-                        'name': item['name'],
-                        'slot': item['slot'] if 'slot' in item else None,
-                        'randomEnchantment': item['randomEnchantment'] if 'randomEnchantment' in item else None,
-                        'notEnchantable': item['notEnchantable'] if 'notEnchantable' in item else False,
-                        'resistance-arcane': item['resistances']['Arcane'] if 'resistances' in item and 'Arcane'
-                                                                              in item['resistances'] else None,
-                        'resistance-fire': item['resistances']['Fire'] if 'resistances' in item and 'Fire'
-                                                                              in item['resistances'] else None,
-                        'resistance-frost': item['resistances']['Frost'] if 'resistances' in item and 'Frost'
-                                                                              in item['resistances'] else None,
-                        'resistance-nature': item['resistances']['Nature'] if 'resistances' in item and 'Nature'
-                                                                              in item['resistances'] else None,
-                        'resistance-shadow': item['resistances']['Shadow'] if 'resistances' in item and 'Shadow'
-                                                                              in item['resistances'] else None,
-                        'sockets': item['sockets'] if 'sockets' in item else None,
-                    }
-
-    async def needs_update(self, fights):
+    async def needs_update(self, end_time):
+        # reads the fights again, true if fights were added to the report after end_time
         await self.get_fights()
+        return self.endTime > end_time
 
-    async def parse_report(self):
-        self._preload_item_data()
+    async def parse_report(self, checkpoint=None):
+        # with a checkpoint (see load_subsequent_data) the parse continues where a previous one ran out of time
         await self.get_fights()
+        if checkpoint is not None:
+            self._restore_checkpoint(checkpoint)
+        await self.load_subsequent_data()
+        if self.checkpoint is not None:
+            print('Out of time, %d jobs done' % len(self._done_jobs))
+            return self
+
+        with instrumentation.timer('rollup'):
+            self._rollup_summary()
+        return self
+
+    async def update_report(self, state):
+        # continues a previous parse (get_state) of a report that is still being uploaded, only the events after
+        # its end are fetched. None if nothing was added since
+        if not await self.needs_update(state['endTime']):
+            print('No fights after %d' % state['endTime'])
+            return None
+
+        self._restore_state(state)
+        # the previous parse already read the events at its endTime
+        self._events_start_time = state['endTime'] + 1
+        self._fight_windows = FightWindows([x for x in self.fights.values()
+                                            if x['start_time'] >= self._events_start_time])
+        print("%d new fights" % len(self._fight_windows.fights))
         await self.load_subsequent_data()
+        if self.checkpoint is not None:
+            raise DeadlineException('Out of time updating %s' % self.report_id)
+
+        with instrumentation.timer('rollup'):
+            self._rollup_summary()
+        return self
+
+    async def parse_fight(self, fight_id):
+        # only the events and tables of a single boss fight, enough for to_json(fight_id). None if it is not a boss
+        # fight of the report
+        await self.get_fights()
+        if fight_id not in self.fights or self.fights[fight_id]['boss'] == 0:
+            return None
+
+        fight = self.fights[fight_id]
+        # from just before the pull, so buffs that were already up are not cut to start with the fight (prebuffs).
+        # anything else from before the fight is aggregated as trash
+        self._events_start_time = fight['start_time'] - 1
+        self._events_end_time = fight['end_time']
+        self._fight_windows = FightWindows([fight])
+        await self.load_subsequent_data(report_summary=False)
+        if self.checkpoint is not None:
+            raise DeadlineException('Out of time parsing fight %d of %s' % (fight_id, self.report_id))
+
         return self
 
+    def get_state(self):
+        # the per fight aggregates before the summary rollup, the summary is rebuilt by every update
+        return {
+            'endTime': self.endTime,
+            'characters': {x['id']: {fight_id: fight.to_state() for fight_id, fight in x['per_fight'].items()
+                                     if fight_id != -1}
+                           for x in self.characters.values()},
+        }
+
+    def _restore_checkpoint(self, checkpoint):
+        # a report that is still being uploaded may have changed since, then it is parsed from the start. So is one
+        # fetched the other way (see _use_report_fetch), its jobs are not the same
+        if checkpoint['endTime'] != self.endTime or checkpoint['metrics'] != self.metrics \
+                or checkpoint['report_fetch'] != self._use_report_fetch():
+            print('Report or configuration changed since the checkpoint, starting over')
+            return
+
+        self._restore_state(checkpoint)
+        # the report wide summary table (the 'summary' job) was already loaded into the summary fight
+        for player_id, fight_state in checkpoint['summaries'].items():
+            if int(player_id) in self.characters:
+                self.characters[int(player_id)]['per_fight'][-1] = FightAccumulator.from_state(fight_state)
+        self._done_jobs = set(checkpoint['done'])
+        self._streams = dict(checkpoint['streams'])
+        self._auras = {int(player_id): {int(guid): bands for guid, bands in player_auras.items()}
+                       for player_id, player_auras in checkpoint['auras'].items()}
+        self._rounds = checkpoint['rounds']
+        self.incomplete = checkpoint['incomplete']
+
+    def _restore_state(self, state):
+        for player_id, per_fight in state['characters'].items():
+            if int(player_id) not in self.characters:
+                continue
+
+            character = self.characters[int(player_id)]
+            for fight_id, fight_state in per_fight.items():
+                character['per_fight'][int(fight_id)] = FightAccumulator.from_state(fight_state)
+
+    async def _get_json(self, url, priority, decode=json_codec.loads):
+        attempt = 0
+        while True:
+            try:
+                async with self._scheduler.get(url, priority) as response:
+                    return await WCLParser._get_json_response(response, decode)
+            except READ_ERRORS as ex:
+                if attempt >= WCLParser.READ_RETRIES:
+                    raise RequestException('Could not read %s - %s' % (url.split('?')[0], ex))
+                print('Could not read %s - %s, retrying' % (url.split('?')[0], ex))
+                attempt += 1
+
     @staticmethod
-    async def _get_json_response(response):
-        print("%s (%d)" % (response.url.human_repr(), response.status))
-        if response.content_type == 'application/json':
-            json_response = await response.json()
+    async def _get_json_response(response, decode=json_codec.loads):
+        instrumentation.verbose("%s (%d)" % (response.url.human_repr(), response.status))
+        if response.status == 200 and response.content_type == 'application/json':
+            body = await response.read()
+            instrumentation.record_bytes(response.url.path, len(body))
+            with instrumentation.timer('decode'):
+                json_response = decode(body)
             return json_response
-        else:
-            text_response = await response.text()
-            print('Unexpected content type "%s" - %s' % (response.content_type, text_response))
 
-        return None
+        text_response = await response.text()
+        raise RequestException('Unexpected response %d "%s" from %s - %s'
+                               % (response.status, response.content_type, response.url.path, text_response[:200]))
 
     async def get_fights(self):
-        async with self._session.get("/v1/report/fights/" + self.report_id + "?api_key=" + WCLParser.API_KEY) as response:
+        with instrumentation.timer('fights'):
+            await self._get_fights()
+
+    async def _get_fights(self):
+        url = "/v1/report/fights/" + self.report_id + "?api_key=" + WCLParser.API_KEY
+        async with self._scheduler.get(url, PRIORITY_REPORT) as response:
             if response.status == 404 or response.status == 400:
                 raise NotFoundException('Could not find report "%s".' % self.report_id)
 
             json_response = await WCLParser._get_json_response(response)
             self.fights = {x['id']: create_fight(x) for x in json_response['fights']}
+            self._fight_windows = FightWindows(self.fights.values())
             print("%d fights" % len(self.fights))
             self.characters = {x['id']: create_character(x, self.fights) for x in json_response['friendlies']
                                if x['type'] != "NPC" and x['type'] != "Pet" and x['type'] != "Boss"}
@@ -171,162 +334,247 @@ class WCLParser:
             self.endTimestamp = json_response['end']
             self.startTime = fight_list[0]['start_time']
             self.endTime = fight_list[len(fight_list)-1]['end_time']
+            self._events_start_time = self.startTime
+            self._events_end_time = self.endTime
+
+    async def _iter_events(self, event_type, start_time, end_time, query='', priority=PRIORITY_EVENTS):
+        # follows nextPageTimestamp, so only a single page of events is held in memory at a time. The callers
+        # aggregate page by page, a checkpoint continues the stream after the last page that was
+        stream = event_type + query
+        if stream in self._streams:
+            start_time = self._streams[stream]
+        decode = event_schema.page_decoder(event_type)
+        while start_time is not None:
+            url = ("/v1/report/events/%s/%s?api_key=%s&start=%d&end=%d%s"
+                   % (event_type, self.report_id, WCLParser.API_KEY, start_time, end_time, query))
+            json_response = await self._get_json(url, priority, decode)
+            next_page = json_response['nextPageTimestamp'] if 'nextPageTimestamp' in json_response else None
+            if next_page is not None and next_page <= start_time:
+                # the same page would be requested forever
+                raise RequestException('Page of %s at %d is followed by %d' % (stream, start_time, next_page))
+            start_time = next_page
+            # the callers aggregate every entry before asking for the next one
+            with instrumentation.timer('aggregate'):
+                for entry in json_response['events']:
+                    yield entry
+            self._streams[stream] = start_time
 
     async def get_character_casts(self, player_id):
-        await self._bucket.acquire()
-        url = ("/v1/report/events/casts/%s?api_key=%s&start=%d&end=%d&sourceid=%d"
-               % (self.report_id, WCLParser.API_KEY, self.startTime, self.endTime, player_id))
-        async with self._session.get(url) as response:
-            json_response = await WCLParser._get_json_response(response)
-            filtered_events = [x for x in json_response['events'] if x['type'] == 'cast']
-            for entry in filtered_events:
-                fight_id = entry['fight']
-                ability_id = entry['ability']['guid']
-                self._set_property_if_empty(player_id, fight_id, {
-                    'boss': 0,
-                    'trash': 0,
-                    'first_event': entry['timestamp'],
-                }, 'casts', ability_id)
-                self._increment_property(player_id, fight_id, 1, 'casts', ability_id,
-                                         'boss' if self.fights[fight_id]['boss'] > 0 else 'trash')
-                self._set_property_if_empty(player_id, -1, {
-                    'boss': 0,
-                    'trash': 0,
-                    'first_event': entry['timestamp'],
-                }, 'casts', ability_id)
-                self._increment_property(player_id, -1, 1, 'casts', ability_id,
-                                         'boss' if self.fights[fight_id]['boss'] > 0 else 'trash')
+        async for entry in self._iter_events('casts', self._events_start_time, self._events_end_time,
+                                             '&sourceid=%d' % player_id, PRIORITY_CHARACTER):
+            self._add_cast(player_id, entry)
 
     async def get_character_buffs(self, player_id):
-        await self._bucket.acquire()
         url = ("/v1/report/tables/buffs/%s?api_key=%s&start=%d&end=%d&sourceid=%d"
-               % (self.report_id, WCLParser.API_KEY, self.startTime, self.endTime, player_id))
-        async with self._session.get(url) as response:
-            json_response = await WCLParser._get_json_response(response)
+               % (self.report_id, WCLParser.API_KEY, self._events_start_time, self._events_end_time, player_id))
+        json_response = await self._get_json(url, PRIORITY_CHARACTER)
+        with instrumentation.timer('aggregate'):
             for entry in json_response['auras']:
-                for fight_band in self.fights.values():
-                    fights = [x for x in entry['bands'] if x['endTime'] > fight_band['start_time']
-                              and x['startTime'] < fight_band['end_time']]
-                    if len(fights) == 0:
-                        continue
-
-                    fight_length = fight_band['end_time'] - fight_band['start_time']
-                    buff_length = sum(x['endTime'] - x['startTime'] for x in fights)
-
-                    self._set_property_if_empty(player_id, fight_band['id'], {
-                        'percentage': 0,
-                        'prebuff': []
-                    }, 'buffs', entry['guid'])
-                    self._increment_property(player_id, fight_band['id'], round(buff_length / fight_length, 3),
-                                             'buffs', entry['guid'], 'percentage')
-
-                    self._set_property_if_empty(player_id, -1, {
-                        'percentage': 0,
-                        'prebuff': []
-                    }, 'buffs', entry['guid'])
-                    self._increment_property(player_id, -1, round(buff_length / fight_length, 3),
-                                             'buffs', entry['guid'], 'percentage')
-
-                    if fight_band['start_time'] in [x['startTime'] for x in entry['bands']]:
-                        self._add_to_fight_property_array_if_empty(player_id, fight_band['id'], fight_band['id'],
-                                                                   'buffs', entry['guid'], 'prebuff')
-                        self._add_to_fight_property_array_if_empty(player_id, -1, fight_band['id'], 'buffs',
-                                                                   entry['guid'], 'prebuff')
-
-                    if entry['guid'] in RESISTANCE_BUFFS:
-                        for resistance in RESISTANCE_BUFFS[entry['guid']].keys():
-                            self._increment_property(player_id, fight_band['id'],
-                                                     RESISTANCE_BUFFS[entry['guid']][resistance],
-                                                     'resistances', resistance)
+                self._add_buff_aura(player_id, entry)
 
     async def get_character_damage_taken(self, player_id):
-        await self._bucket.acquire()
-        url = ("/v1/report/events/damage-taken/%s?api_key=%s&start=%d&end=%d&sourceid=%d"
-               % (self.report_id, WCLParser.API_KEY, self.startTime, self.endTime, player_id))
-        async with self._session.get(url) as response:
-            json_response = await WCLParser._get_json_response(response)
-            for entry in json_response['events']:
-                fight_id = entry['fight']
+        async for entry in self._iter_events('damage-taken', self._events_start_time, self._events_end_time,
+                                             '&sourceid=%d' % player_id, PRIORITY_CHARACTER):
+            self._add_damage_taken(player_id, entry)
 
     async def get_character_healing(self, player_id):
-        await self._bucket.acquire()
-        url = ("/v1/report/events/healing/%s?api_key=%s&start=%d&end=%d&sourceid=%d"
-               % (self.report_id, WCLParser.API_KEY, self.startTime, self.endTime, player_id))
-        async with self._session.get(url) as response:
-            json_response = await WCLParser._get_json_response(response)
-            for entry in json_response['events']:
-                fight_id = entry['fight']
-                ability_id = entry['ability']['guid']
-                self._set_property_if_empty(player_id, fight_id, {
-                    'count': 0,
-                    'amount': 0,
-                    'first_event': entry['timestamp'],
-                }, 'healing', ability_id)
-                self._increment_property(player_id, fight_id, 1, 'healing', ability_id, 'count')
-                self._increment_property(player_id, fight_id, entry['amount'], 'healing', ability_id, 'amount')
-
-                self._set_property_if_empty(player_id, -1, {
-                    'count': 0,
-                    'amount': 0,
-                    'first_event': entry['timestamp'],
-                }, 'healing', ability_id)
-                self._increment_property(player_id, -1, 1, 'healing', ability_id, 'count')
-                self._increment_property(player_id, -1, entry['amount'], 'healing', ability_id, 'amount')
+        async for entry in self._iter_events('healing', self._events_start_time, self._events_end_time,
+                                             '&sourceid=%d' % player_id, PRIORITY_CHARACTER):
+            self._add_healing(player_id, entry)
+
+    async def get_report_casts(self):
+        async for entry in self._iter_events('casts', self._events_start_time, self._events_end_time):
+            if entry['sourceID'] in self.characters:
+                self._add_cast(entry['sourceID'], entry)
+
+    async def get_report_buffs(self):
+        # rebuilds the bands of the per character buffs table from apply/remove events. Nothing is aggregated before
+        # the last page, the bands rebuilt so far are kept in the checkpoint with the position of the stream
+        auras = self._auras
+        for player_id in self.characters.keys():
+            auras.setdefault(player_id, {})
+        async for entry in self._iter_events('buffs', self._events_start_time, self._events_end_time):
+            if 'targetID' not in entry or entry['targetID'] not in auras:
+                continue
+
+            bands = auras[entry['targetID']].setdefault(entry['ability']['guid'], [])
+            is_open = len(bands) > 0 and bands[-1]['endTime'] is None
+            if entry['type'] == 'applybuff' and not is_open:
+                bands.append({'startTime': entry['timestamp'], 'endTime': None})
+            elif entry['type'] == 'removebuff':
+                if is_open:
+                    bands[-1]['endTime'] = entry['timestamp']
+                elif len(bands) == 0:
+                    # buff was already active when logging started
+                    bands.append({'startTime': self._events_start_time, 'endTime': entry['timestamp']})
+
+        with instrumentation.timer('aggregate'):
+            for player_id, player_auras in auras.items():
+                for guid, bands in player_auras.items():
+                    if len(bands) > 0 and bands[-1]['endTime'] is None:
+                        bands[-1]['endTime'] = self._events_end_time
+                    self._add_buff_aura(player_id, {'guid': guid, 'bands': bands})
+        self._auras = {}
+
+    async def get_report_damage_taken(self):
+        async for entry in self._iter_events('damage-taken', self._events_start_time, self._events_end_time):
+            if 'targetID' in entry and entry['targetID'] in self.characters:
+                self._add_damage_taken(entry['targetID'], entry)
+
+    async def get_report_healing(self):
+        async for entry in self._iter_events('healing', self._events_start_time, self._events_end_time):
+            if entry['sourceID'] in self.characters:
+                self._add_healing(entry['sourceID'], entry)
+
+    def _add_cast(self, player_id, entry):
+        if entry['type'] != 'cast':
+            return
+
+        fight = self._get_fight(player_id, entry['fight'])
+        if fight is None:
+            return
+
+        ability_id = entry['ability']['guid']
+        is_boss = self.fights[entry['fight']]['boss'] > 0
+        fight.add_cast(ability_id, entry['timestamp'], is_boss)
+
+    def _add_buff_aura(self, player_id, entry):
+        if player_id not in self.characters:
+            return
+
+        for (fight_band, buff_length, prebuff) in self._fight_windows.band_overlaps(entry['bands']):
+            fight = self._get_fight(player_id, fight_band['id'])
+            fight_length = fight_band['end_time'] - fight_band['start_time']
+
+            fight.add_buff_uptime(entry['guid'], round(buff_length / fight_length, 3))
+
+            if prebuff:
+                fight.add_prebuff(entry['guid'], fight_band['id'])
+
+            if entry['guid'] in RESISTANCE_BUFFS:
+                for resistance in RESISTANCE_BUFFS[entry['guid']].keys():
+                    fight.add_resistance(resistance, RESISTANCE_BUFFS[entry['guid']][resistance])
+
+    def _add_damage_taken(self, player_id, entry):
+        fight = self._get_fight(player_id, entry['fight'] if 'fight' in entry else None)
+        if fight is None:
+            return
+
+        fight.add_damage_taken(entry['ability']['guid'], entry['amount'] if 'amount' in entry else 0)
+
+    def _add_healing(self, player_id, entry):
+        fight = self._get_fight(player_id, entry['fight'])
+        if fight is None:
+            return
+
+        ability_id = entry['ability']['guid']
+        fight.add_healing(ability_id, entry['timestamp'], entry['amount'])
 
     async def get_deaths(self):
-        await self._bucket.acquire()
         url = ("/v1/report/tables/deaths/%s?api_key=%s&start=%d&end=%d"
-               % (self.report_id, WCLParser.API_KEY, self.startTime, self.endTime))
-        async with self._session.get(url) as response:
-            json_response = await WCLParser._get_json_response(response)
-            for entry in json_response['entries']:
-                self._increment_property(entry['id'], entry['fight'], 1, 'deaths')
-                self._increment_property(entry['id'], -1, 1, 'deaths')
+               % (self.report_id, WCLParser.API_KEY, self._events_start_time, self._events_end_time))
+        json_response = await self._get_json(url, PRIORITY_REPORT)
+        for entry in json_response['entries']:
+            fight = self._get_fight(entry['id'], entry['fight'])
+            if fight is None:
+                continue
+
+            fight.add_death()
 
     async def get_interrupts(self):
-        await self._bucket.acquire()
-        url = ("/v1/report/events/interrupts/%s?api_key=%s&start=%d&end=%d"
-               % (self.report_id, WCLParser.API_KEY, self.startTime, self.endTime))
-        async with self._session.get(url) as response:
-            json_response = await WCLParser._get_json_response(response)
-            for entry in json_response['events']:
-                player_id = entry['sourceID']
-                if player_id not in self.characters:
-                    if player_id not in self.pets:
-                        continue
-                    player_id = self.pets[player_id]['pet_owner']
+        async for entry in self._iter_events('interrupts', self._events_start_time, self._events_end_time):
+            player_id = entry['sourceID']
+            if player_id not in self.characters:
+                if player_id not in self.pets:
+                    continue
+                player_id = self.pets[player_id]['pet_owner']
+
+            fight = self._get_fight(player_id, entry['fight'])
+            if fight is None:
+                continue
 
-                self._increment_property(player_id, entry['fight'], 1, 'interrupts', entry['ability']['guid'])
-                self._increment_property(player_id, -1, 1, 'interrupts', entry['ability']['guid'])
+            fight.add_interrupt(entry['ability']['guid'])
 
     async def get_character_summary(self):
-        await self._bucket.acquire()
         url = ("/v1/report/tables/summary/%s?api_key=%s&start=%d&end=%d"
                % (self.report_id, WCLParser.API_KEY, self.startTime, self.endTime))
-        async with self._session.get(url) as response:
-            json_response = await WCLParser._get_json_response(response)
+        json_response = await self._get_json(url, PRIORITY_REPORT)
+        with instrumentation.timer('aggregate'):
             self._load_character_summary(json_response)
 
     async def get_character_summary_by_fight(self, fight):
-        await self._bucket.acquire()
         fight_data = self.fights[fight]
         url = ("/v1/report/tables/summary/%s?api_key=%s&start=%d&end=%d&fight=%d"
                % (self.report_id, WCLParser.API_KEY, fight_data['start_time'], fight_data['end_time'], fight))
-        async with self._session.get(url) as response:
-            json_response = await WCLParser._get_json_response(response)
+        json_response = await self._get_json(url, PRIORITY_REPORT)
+        with instrumentation.timer('aggregate'):
             self._load_character_summary(json_response, fight)
 
-    async def load_subsequent_data(self):
-        tasks = [self.get_deaths(), self.get_interrupts(), self.get_character_summary()]
-        for y in [f['id'] for f in self.fights.values() if f['boss'] > 0]:
-            tasks.append(self.get_character_summary_by_fight(y))
-
-        for x in self.characters.keys():
-            tasks.append(self.get_character_casts(x))
-            tasks.append(self.get_character_buffs(x))
-            tasks.append(self.get_character_damage_taken(x))
-            tasks.append(self.get_character_healing(x))
-        responses = await asyncio.gather(*tasks)
+    def _use_report_fetch(self):
+        if self.fetch_mode == FETCH_MODE_AUTO:
+            return len(self.characters) >= WCLParser.REPORT_FETCH_MIN_CHARACTERS
+
+        return self.fetch_mode == FETCH_MODE_REPORT
+
+    def _sections(self):
+        return self.metrics + ['summary']
+
+    async def load_subsequent_data(self, report_summary=True):
+        # jobs are (job id, section, character id or None, fetch, arguments). The report wide tables first, then the
+        # summaries and the per character or per report metrics
+        jobs = [(x, x, None, getattr(self, FETCH_PLAN[x][1]), ()) for x in self.metrics if FETCH_PLAN[x][0] is None]
+        if report_summary:
+            jobs.append(('summary', 'summary', None, self.get_character_summary, ()))
+        for y in [f['id'] for f in self.fights.values()
+                  if f['boss'] > 0 and self._events_start_time <= f['start_time'] <= self._events_end_time]:
+            jobs.append(('summary/%d' % y, 'summary', None, self.get_character_summary_by_fight, (y,)))
+
+        use_report_fetch = self._use_report_fetch()
+        for metric in self.metrics:
+            (character_fetch, report_fetch) = FETCH_PLAN[metric]
+            if character_fetch is None:
+                continue
+            if use_report_fetch:
+                jobs.append((metric, metric, None, getattr(self, report_fetch), ()))
+            else:
+                for x in self.characters.keys():
+                    jobs.append(('%s/%d' % (metric, x), metric, x, getattr(self, character_fetch), (x,)))
+
+        # jobs finished before a checkpoint are not run again
+        sections = {job_id: (section, player_id) for (job_id, section, player_id, _, _) in jobs}
+        pending = [(job_id, self._run_job(job_id, fetch(*arguments))) for (job_id, _, _, fetch, arguments) in jobs
+                   if job_id not in self._done_jobs]
+
+        # the first failure cancels the other requests, unless partial results keep going without its section.
+        # Jobs that ran out of time are left for the checkpoint
+        max_failures = int(len(pending) * PARTIAL_RESULTS_MAX_FAILED) if PARTIAL_RESULTS else 0
+        with instrumentation.timer('fetch'):
+            failures = await run_supervised(pending, RequestException, max_failures, DeadlineException)
+
+        out_of_time = False
+        for (job_id, ex) in failures:
+            if isinstance(ex, DeadlineException):
+                out_of_time = True
+                continue
+
+            (section, player_id) = sections[job_id]
+            print('Incomplete %s%s - %s' % (section, '' if player_id is None else ' of %d' % player_id, ex.message))
+            self._done_jobs.add(job_id)
+            if player_id is None:
+                self.incomplete[section] = None
+            elif self.incomplete.get(section, []) is not None:
+                self.incomplete.setdefault(section, []).append(player_id)
+
+        if out_of_time:
+            summaries = {x['id']: x['per_fight'][-1].to_state() for x in self.characters.values()}
+            self.checkpoint = dict(self.get_state(), summaries=summaries, metrics=self.metrics,
+                                   report_fetch=self._use_report_fetch(), done=sorted(self._done_jobs),
+                                   streams=self._streams, auras=self._auras, rounds=self._rounds + 1,
+                                   incomplete=self.incomplete)
+
+    async def _run_job(self, job_id, coroutine):
+        await coroutine
+        self._done_jobs.add(job_id)
 
     def _load_character_summary(self, data, fight=-1):
         player_details = data['playerDetails']
@@ -340,60 +588,63 @@ class WCLParser:
         if 'dps' in player_details:
             self._load_player_details(fight, player_details['dps'], 'dps')
 
-    def _load_player_details(self, fight, player_data, role):
+    def _load_player_details(self, fight_id, player_data, role):
         for player in player_data:
-            player_id = player['id']
+            fight = self._get_fight(player['id'], fight_id)
+            if fight is None:
+                continue
 
             # load gear (player['combatantInfo']['gear']
             if 'combatantInfo' in player:
                 if 'gear' in player['combatantInfo']:
-                    self._load_player_gear(fight, player_id, player['combatantInfo']['gear'])
+                    self._load_player_gear(fight, player['combatantInfo']['gear'])
 
-            self._add_to_fight_property_array(player_id, fight, 'roles', role)
+            fight.add_role(role)
             if 'specs' in player:
                 for spec in player['specs']:
-                    self._add_to_fight_property_array(player_id, fight, 'specs', spec)
+                    fight.add_spec(spec)
 
-    def _add_resistance_from_gear(self, player_id, fight_id, gear_item, resistance):
+    @staticmethod
+    def _add_resistance_from_gear(fight, gear_item, resistance):
         if gear_item is None:
             return
 
         key = 'resistance-' + resistance
 
         if key in gear_item and gear_item[key] is not None:
-            self._increment_property(player_id, fight_id, gear_item[key], 'resistances', resistance)
+            fight.add_resistance(resistance, gear_item[key])
 
-    def _load_player_gear(self, fight_id, player_id, gear_list):
+    def _load_player_gear(self, fight, gear_list):
         for gear in gear_list:
             gear_id = gear['id']
             gear_slot = gear['slot']
             gear_item = None
 
             if gear_slot != SLOT_SHIRT and gear_slot != SLOT_TABARD and gear_id != 0:
-                if gear_id in self._item_cache.keys():
-                    gear_item = self._item_cache[gear_id]
-                else:
-                    print('Could not find item %d (%s)' % (gear_id, gear['name'] if 'name' in gear else 'Unknown'))
+                gear_item = item_index.get_item(gear_id)
+                if gear_item is None:
+                    instrumentation.verbose('Could not find item %d (%s)'
+                                            % (gear_id, gear['name'] if 'name' in gear else 'Unknown'))
 
             # resistances from gear
-            self._add_resistance_from_gear(player_id, fight_id, gear_item, 'arcane')
-            self._add_resistance_from_gear(player_id, fight_id, gear_item, 'fire')
-            self._add_resistance_from_gear(player_id, fight_id, gear_item, 'frost')
-            self._add_resistance_from_gear(player_id, fight_id, gear_item, 'nature')
-            self._add_resistance_from_gear(player_id, fight_id, gear_item, 'shadow')
+            self._add_resistance_from_gear(fight, gear_item, 'arcane')
+            self._add_resistance_from_gear(fight, gear_item, 'fire')
+            self._add_resistance_from_gear(fight, gear_item, 'frost')
+            self._add_resistance_from_gear(fight, gear_item, 'nature')
+            self._add_resistance_from_gear(fight, gear_item, 'shadow')
 
             # resistances from random enchantments
             if gear_item is not None and 'randomEnchantment' in gear_item and gear_item['randomEnchantment'] is True \
                     and gear_slot in RESIST_RANDOM_ENCHANT_BY_SLOT \
                     and gear['itemLevel'] in RESIST_RANDOM_ENCHANT_BY_SLOT[gear_slot]:
                 resistance_amount = RESIST_RANDOM_ENCHANT_BY_SLOT[gear_slot][gear['itemLevel']]
-                self._increment_property(player_id, fight_id, resistance_amount, 'resistances', 'random_enchantment')
+                fight.add_resistance('random_enchantment', resistance_amount)
 
             # enchants (needs item data)
             if gear['id'] != 0 \
                     and (gear_item is None or ('notEnchantable' in gear_item and gear_item['notEnchantable'] is False))\
                     and (gear_slot not in UNENCHANTABLE_SLOTS or 'permanentEnchant' in gear):
-                self._add_to_fight_property_array(player_id, fight_id, 'enchants', {
+                fight.add_enchant({
                     'id': gear['permanentEnchant'] if 'permanentEnchant' in gear else None,
                     'gearId': gear_id,
                     'name': gear['permanentEnchantName'] if 'permanentEnchantName' in gear else None,
@@ -403,138 +654,46 @@ class WCLParser:
                 # resistances from enchants
                 if 'permanentEnchant' in gear and gear['permanentEnchant'] in RESISTANCE_ENCHANTS:
                     for resistance in RESISTANCE_ENCHANTS[gear['permanentEnchant']].keys():
-                        self._increment_property(player_id, fight_id,
-                                                 RESISTANCE_ENCHANTS[gear['permanentEnchant']][resistance],
-                                                 'resistances', resistance)
+                        fight.add_resistance(resistance, RESISTANCE_ENCHANTS[gear['permanentEnchant']][resistance])
 
             # imbues
             if gear_slot == SLOT_MAIN_HAND and 'temporaryEnchant' in gear:
-                self._add_to_fight_property_array_with_sub_property(player_id, fight_id, 'imbues', 'main_hand',
-                                                                    gear['temporaryEnchant'])
-                # self._increment_fight_property_with_sub_property(player_id, fight_id, 'imbues', 'main_hand',
-                #                                                  gear['temporaryEnchant'], False)
+                fight.add_imbue('main_hand', gear['temporaryEnchant'])
 
             if gear_slot == SLOT_OFF_HAND and 'temporaryEnchant' in gear:
-                self._add_to_fight_property_array_with_sub_property(player_id, fight_id, 'imbues', 'off_hand',
-                                                                    gear['temporaryEnchant'])
-                # self._increment_fight_property_with_sub_property(player_id, fight_id, 'imbues', 'off_hand',
-                #                                                  gear['temporaryEnchant'], False)
+                fight.add_imbue('off_hand', gear['temporaryEnchant'])
 
             # gems
             gem_count = 0
             if 'gems' in gear:
                 for gem in gear['gems']:
-                    self._increment_property(player_id, fight_id, 1, 'gems', gem['id'])
+                    fight.add_gems(gem['id'], 1)
                     # resistance gems
                     if gem['id'] in RESISTANCE_GEMS:
                         for resistance in RESISTANCE_GEMS[gem['id']].keys():
-                            self._increment_property(player_id, fight_id, RESISTANCE_GEMS[gem['id']][resistance],
-                                                     'resistances', resistance)
+                            fight.add_resistance(resistance, RESISTANCE_GEMS[gem['id']][resistance])
 
                 gem_count = len(gear['gems'])
 
             # missing gems
             if gear_item is not None and 'sockets' in gear_item and gear_item['sockets'] is not None:
                 if gear_item['sockets'] > gem_count:
-                    self._increment_property(player_id, fight_id, gear_item['sockets'] - gem_count, 'gems', 0)
+                    fight.add_gems(0, gear_item['sockets'] - gem_count)
 
     def _get_fight(self, player_id, fight_id):
         if player_id not in self.characters:
-            return None,None
+            return None
 
         character = self.characters[player_id]
         if fight_id in character['per_fight']:
-            return character['per_fight'][fight_id], character['per_fight'][-1]
-        else:
-            return character['per_fight'][0], character['per_fight'][-1]
-
-    def _increment_property(self, player_id, fight_id, amount=1, *args):
-        (fight, summary_fight) = self._get_fight(player_id, fight_id)
-
-        if fight is None:
-            return
-
-        node = fight
-        for arg_index in range(0, len(args)):
-            if args[arg_index] not in node:
-                if arg_index == len(args)-1:
-                    node[args[arg_index]] = amount
-                else:
-                    node[args[arg_index]] = {}
-
-            else:
-                if arg_index == len(args)-1:
-                    node[args[arg_index]] = node[args[arg_index]] + amount
-
-            node = node[args[arg_index]]
-
-    def _add_to_fight_property_array(self, player_id, fight_id, property_name, value):
-        (fight, summary_fight) = self._get_fight(player_id, fight_id)
-
-        if fight is None:
-            return
-
-        if property_name in fight:
-            if value not in fight[property_name]:
-                fight[property_name].append(value)
+            return character['per_fight'][fight_id]
         else:
-            fight[property_name] = [value]
-
-    def _add_to_fight_property_array_with_sub_property(self, player_id, fight_id, property_name, sub_property, value):
-        (fight, summary_fight) = self._get_fight(player_id, fight_id)
-
-        if fight is None:
-            return
-
-        if property_name in fight:
-            if sub_property in fight[property_name]:
-                if value not in fight[property_name][sub_property]:
-                    fight[property_name][sub_property].append(value)
-            else:
-                fight[property_name][sub_property] = [value]
-        else:
-            fight[property_name] = {
-                sub_property: [value]
-            }
-
-    def _set_fight_property_with_sub_property(self, player_id, fight_id, property_name, sub_property, value):
-        (fight, summary_fight) = self._get_fight(player_id, fight_id)
-
-        if fight is None:
-            return
-
-        if property_name in fight:
-            fight[property_name][sub_property] = value
-        else:
-            fight[property_name] = {
-                sub_property: value
-            }
-
-    def _set_property_if_empty(self, player_id, fight_id, value, *args):
-        (fight, summary_fight) = self._get_fight(player_id, fight_id)
-
-        if fight is None:
-            return
-
-        node = fight
-        for arg_index in range(0, len(args)):
-            if args[arg_index] not in node:
-                if arg_index == len(args) - 1:
-                    node[args[arg_index]] = value
-                else:
-                    node[args[arg_index]] = {}
-
-            node = node[args[arg_index]]
-
-    def _add_to_fight_property_array_if_empty(self, player_id, fight_id, value, *args):
-        (fight, summary_fight) = self._get_fight(player_id, fight_id)
-
-        if fight is None:
-            return
-
-        node = fight
-        for arg_index in range(0, len(args)):
-            if arg_index == len(args) - 1:
-                node[args[arg_index]].append(value)
-
-            node = node[args[arg_index]]
+            return character['per_fight'][0]
+
+    def _rollup_summary(self):
+        # the summary is only written here, events are aggregated once into their boss fight or trash
+        for character in self.characters.values():
+            summary_fight = character['per_fight'][-1]
+            for fight_id, fight in character['per_fight'].items():
+                if fight_id != -1:
+                    summary_fight.merge(fight)
@@ -0,0 +1,100 @@
+import asyncio
+import atexit
+import os
+import time
+import aiohttp
+
+
+# a warm container keeps its event loop and session, so connections to warcraftlogs (and their TLS handshakes) are
+# reused by the following invocations
+DNS_CACHE_TTL = int(os.environ.get('WCL_DNS_CACHE_TTL', '300'))
+KEEPALIVE_TIMEOUT = float(os.environ.get('WCL_KEEPALIVE_TIMEOUT', '60'))
+
+_loop = None
+# base url -> session
+_sessions = {}
+_connection_stats = {
+    'requests': 0,
+    'connections_created': 0,
+    'connections_reused': 0,
+    'connect_ms': 0.0,
+    'dns_cache_hits': 0,
+    'dns_cache_misses': 0,
+}
+
+
+def get_event_loop():
+    global _loop
+
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+
+    return _loop
+
+
+def run(coroutine):
+    # like asyncio.run, but the loop and the connections opened on it stay open for the next invocation
+    return get_event_loop().run_until_complete(coroutine)
+
+
+def _count(name, amount=1):
+    _connection_stats[name] += amount
+
+
+def _create_trace_config():
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context, params):
+        _count('requests')
+
+    async def on_connection_create_start(session, context, params):
+        context.connect_started = time.perf_counter()
+
+    async def on_connection_create_end(session, context, params):
+        _count('connections_created')
+        _count('connect_ms', (time.perf_counter() - context.connect_started) * 1000)
+
+    async def on_connection_reuseconn(session, context, params):
+        _count('connections_reused')
+
+    async def on_dns_cache_hit(session, context, params):
+        _count('dns_cache_hits')
+
+    async def on_dns_cache_miss(session, context, params):
+        _count('dns_cache_misses')
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+    trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+    return trace_config
+
+
+def get_session(base_url, limit_per_host):
+    # has to be called from a coroutine running on get_event_loop(). The session is never closed, a warm container
+    # keeps it until it is shut down
+    session = _sessions.get(base_url)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=limit_per_host, limit_per_host=limit_per_host,
+                                         ttl_dns_cache=DNS_CACHE_TTL, keepalive_timeout=KEEPALIVE_TIMEOUT)
+        session = _sessions[base_url] = aiohttp.ClientSession(base_url, connector=connector,
+                                                              trace_configs=[_create_trace_config()])
+
+    return session
+
+
+@atexit.register
+def close():
+    for session in _sessions.values():
+        if not session.closed and _loop is not None and not _loop.is_closed():
+            _loop.run_until_complete(session.close())
+    _sessions.clear()
+
+
+def connection_stats():
+    stats = dict(_connection_stats)
+    stats['connect_ms'] = round(stats['connect_ms'], 1)
+    return stats